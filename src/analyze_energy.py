@@ -2,6 +2,39 @@ import numpy as np
 import matplotlib.pyplot as plt
 import glob
 import os
+from concurrent.futures import ThreadPoolExecutor
+from io_utils import load_checkpoint_arrays
+
+DT = 0.000004 # Time step from simulation.py
+G = 100.0     # Gravity magnitude
+IO_WORKERS = 4 # Checkpoints read ahead concurrently
+
+def process_frame(filename):
+    """
+    Computes the energy budget of one checkpoint.
+    Returns (step, Ek, Ep, Ei).
+    """
+    # Only the arrays needed for the energy budget are mapped from the archive
+    keys = ('step', 'velocities', 'masses', 'positions')
+    try:
+        data = load_checkpoint_arrays(filename, keys + ('internal_energy',))
+    except KeyError:
+        # Older checkpoints predate internal energy tracking
+        data = load_checkpoint_arrays(filename, keys)
+    step = int(data['step'])
+    velocities = data['velocities']
+    masses = data['masses']
+    
+    # Kinetic Energy: 0.5 * sum(m * (vx^2 + vy^2)), fused into one pass over v
+    Ek = 0.5 * np.einsum('i,ij,ij->', masses, velocities, velocities, dtype=np.float64)
+    
+    # Potential Energy: m * g * y
+    Ep = G * np.einsum('i,i->', masses, data['positions'][:, 1], dtype=np.float64)
+    
+    # Internal Energy (Heat/Viscous work)
+    Ei = float(data['internal_energy']) if 'internal_energy' in data else 0.0
+    
+    return step, Ek, Ep, Ei
 
 def main():
     # 1. Find all checkpoints
@@ -12,57 +45,23 @@ def main():
 
     print(f"Found {len(files)} checkpoints. Calculating energy...")
 
-    steps = []
-    times = []
-    Ek_list = []
-    Ep_list = []
-    Ei_list = []
-    Etot_list = []
-
-    dt = 0.000004 # Time step from simulation.py
-    g = 100.0     # Gravity magnitude
+    n_files = len(files)
+    steps = np.empty(n_files, dtype=np.int64)
+    Ek_list = np.empty(n_files)
+    Ep_list = np.empty(n_files)
+    Ei_list = np.empty(n_files)
 
-    for i, filename in enumerate(files):
-        if i % 10 == 0:
-            print(f"Processing {filename}...")
-            
-        data = np.load(filename)
-        
-        step = data['step']
-        positions = data['positions']
-        velocities = data['velocities']
-        masses = data['masses']
-        
-        # Current time
-        t = step * dt
-        
-        # Kinetic Energy: 0.5 * m * v^2
-        # v^2 = vx^2 + vy^2
-        v_sq = np.sum(velocities**2, axis=1)
-        Ek = 0.5 * np.sum(masses * v_sq)
-        
-        # Potential Energy: m * g * y
-        y_coords = positions[:, 1]
-        Ep = np.sum(masses * g * y_coords)
-        
-        # Internal Energy (Heat/Viscous work)
-        Ei = float(data['internal_energy']) if 'internal_energy' in data else 0.0
-        
-        Etot = Ek + Ep + Ei
-        
-        steps.append(step)
-        times.append(t)
-        Ek_list.append(Ek)
-        Ep_list.append(Ep)
-        Ei_list.append(Ei)
-        Etot_list.append(Etot)
+    # Checkpoints are independent reductions. Page-ins of the mapped arrays and the
+    # NumPy reductions release the GIL, so a small thread pool keeps the next files
+    # loading while earlier ones are reduced, without process start-up or pickling.
+    with ThreadPoolExecutor(max_workers=IO_WORKERS) as ex:
+        for i, row in enumerate(ex.map(process_frame, files)):
+            if i % 10 == 0:
+                print(f"Processing {files[i]}...")
+            steps[i], Ek_list[i], Ep_list[i], Ei_list[i] = row
 
-    # Convert to numpy arrays for easier plotting
-    times = np.array(times)
-    Ek_list = np.array(Ek_list)
-    Ep_list = np.array(Ep_list)
-    Ei_list = np.array(Ei_list)
-    Etot_list = np.array(Etot_list)
+    times = steps * DT
+    Etot_list = Ek_list + Ep_list + Ei_list
 
     # Plotting
     if not os.path.exists('output_analysis'):
@@ -2,6 +2,40 @@ import numpy as np
 import matplotlib.pyplot as plt
 import glob
 import os
+from concurrent.futures import ProcessPoolExecutor
+from io_utils import load_checkpoint_arrays
+from stats_utils import partition_percentile
+
+DT = 0.000004
+
+def process_frame(filename):
+    """
+    Computes the mixing layer width of one checkpoint.
+    Returns (step, width), or None if either fluid is absent.
+    """
+    # Read just the three members needed, memory-mapped straight from the archive
+    data = load_checkpoint_arrays(filename, ('step', 'positions', 'colors'))
+    
+    step = int(data['step'])
+    positions = data['positions']
+    colors = data['colors'] # 0 for light, 1 for heavy
+    
+    # Separate fluids: only the y column is needed, so mask a contiguous 1D copy
+    # of it rather than fancy-indexing full (N, 2) position rows
+    y = np.ascontiguousarray(positions[:, 1])
+    y_light = y[colors == 0]
+    y_heavy = y[colors == 1]
+    
+    if len(y_light) == 0 or len(y_heavy) == 0:
+        return None
+        
+    # h_bubble: Top of light fluid (rising) -> Use 99th percentile
+    h_bubble = partition_percentile(y_light, 99)
+    
+    # h_spike: Bottom of heavy fluid (falling) -> Use 1st percentile
+    h_spike = partition_percentile(y_heavy, 1)
+    
+    return step, h_bubble - h_spike
 
 def main():
     # 1. Find all checkpoints
@@ -13,11 +47,8 @@ def main():
     print(f"Found {len(files)} checkpoints. Calculating mixing width...")
 
     steps = []
-    times = []
     widths = []
 
-    dt = 0.000004 
-    
     # Fluid parameters for Atwood number
     # Try to load from first checkpoint if available
     first_data = np.load(files[0])
@@ -39,35 +70,15 @@ def main():
     print(f"Using Densities: L={rho_light:.0f}, H={rho_heavy:.0f}")
     print(f"Atwood Number A = {Atwood:.3f}")
 
-    for i, filename in enumerate(files):
-        data = np.load(filename)
-        
-        step = data['step']
-        positions = data['positions']
-        colors = data['colors'] # 0 for light, 1 for heavy
-        
-        t = step * dt
-        
-        # Separate fluids
-        pos_light = positions[colors == 0]
-        pos_heavy = positions[colors == 1]
-        
-        if len(pos_light) == 0 or len(pos_heavy) == 0:
-            continue
-            
-        # h_bubble: Top of light fluid (rising) -> Use 99th percentile
-        h_bubble = np.percentile(pos_light[:, 1], 99)
-        
-        # h_spike: Bottom of heavy fluid (falling) -> Use 1st percentile
-        h_spike = np.percentile(pos_heavy[:, 1], 1)
-        
-        width = h_bubble - h_spike
-        
-        steps.append(step)
-        times.append(t)
-        widths.append(width)
+    # Checkpoints are independent reductions: spread them over all cores
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as ex:
+        for row in ex.map(process_frame, files, chunksize=8):
+            if row is None:
+                continue
+            steps.append(row[0])
+            widths.append(row[1])
 
-    times = np.array(times)
+    times = np.array(steps) * DT
     widths = np.array(widths)
     
     # 2. Normalize widths to start at 0 (Growth definition)
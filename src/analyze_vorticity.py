@@ -1,20 +1,103 @@
+import matplotlib
+matplotlib.use('Agg')
 import numpy as np
 import matplotlib.pyplot as plt
 import glob
 import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from numba import set_num_threads
 
 # Add src to path to import simulation
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 try:
-    from src.viz_utils import render_fluid_grid
+    from src.viz_utils import get_velocity_grids, vorticity_and_enstrophy
+    from src.io_utils import load_checkpoint_arrays
 except ImportError:
     try:
-        from viz_utils import render_fluid_grid
+        from viz_utils import get_velocity_grids, vorticity_and_enstrophy
+        from io_utils import load_checkpoint_arrays
     except ImportError:
-        print("Could not import render_fluid_grid from viz_utils.py")
+        print("Could not import get_velocity_grids from viz_utils.py")
         sys.exit(1)
 
+DT = 0.000004
+H = 0.0005
+
+# Grid settings (match visualization)
+VIZ_NX = 400
+VIZ_NY = 200
+DOMAIN_X = 0.1
+DOMAIN_Y = 0.05
+
+# Use a fixed scale for animation stability
+# Based on previous runs, +/- 50 to 100 is a good range for vorticity
+VORTICITY_LIMIT = 100.0
+
+# Per-worker figure, created once by _init_worker and reused for every frame
+_fig = None
+_im = None
+_title = None
+
+def _init_worker():
+    """
+    Builds the vorticity figure once for this worker process.
+    Frames only swap the image data and title text, so the axes,
+    colorbar and layout are never rebuilt.
+    The pool already runs one frame per core, so the worker's Numba kernels
+    (renderer, vorticity) run single-threaded instead of oversubscribing.
+    """
+    global _fig, _im, _title
+    set_num_threads(1)
+    _fig = plt.figure(figsize=(10, 5), facecolor='black')
+    ax = _fig.gca()
+    ax.set_facecolor('black')
+    
+    _im = ax.imshow(np.zeros((VIZ_NY, VIZ_NX)), origin='lower', extent=[0, DOMAIN_X, 0, DOMAIN_Y], 
+                    cmap='seismic', vmin=-VORTICITY_LIMIT, vmax=VORTICITY_LIMIT, interpolation='bicubic')
+    
+    ax.axis('off')
+    _title = ax.set_title("", color='white')
+    
+    cbar = _fig.colorbar(_im, ax=ax, fraction=0.046, pad=0.04)
+    cbar.ax.yaxis.set_tick_params(color='white')
+    plt.setp(plt.getp(cbar.ax.axes, 'yticklabels'), color='white')
+    cbar.set_label('Vorticity (1/s)', color='white')
+    
+    _fig.tight_layout()
+
+def process_frame(args):
+    """
+    Computes vorticity and enstrophy for one checkpoint and saves its map.
+    Returns (step, t, enstrophy).
+    """
+    i, n_files, filename = args
+    if _fig is None:
+        _init_worker()
+
+    dx = DOMAIN_X / VIZ_NX
+    dy = DOMAIN_Y / VIZ_NY
+
+    step = load_checkpoint_arrays(filename, ('step',))['step']
+    
+    t = step * DT
+    
+    # Interpolate Vx and Vy (shared on-disk cache with analyze_spectra)
+    grid_vx, grid_vy = get_velocity_grids(filename, H, VIZ_NX, VIZ_NY, DOMAIN_X, DOMAIN_Y)
+    
+    # Vorticity (dVy/dx - dVx/dy) and enstrophy in one fused pass
+    vorticity, enstrophy = vorticity_and_enstrophy(grid_vx, grid_vy, dx, dy)
+    
+    # Save Vorticity Map for every frame
+    print(f"Generating Vorticity Map for step {step} ({i+1}/{n_files})...", flush=True)
+    _im.set_data(vorticity)
+    _title.set_text(f"Vorticity Field (Step {step})")
+    
+    output_map = f"output_analysis/vorticity_map_{step:05d}.png"
+    _fig.savefig(output_map, facecolor='black', edgecolor='none')
+
+    return int(step), t, enstrophy
+
 def main():
     # 1. Find all checkpoints
     files = sorted(glob.glob("data/checkpoint_*.npz"))
@@ -24,75 +107,18 @@ def main():
 
     print(f"Found {len(files)} checkpoints. Calculating vorticity...")
 
-    steps = []
-    times = []
-    enstrophies = []
-    
-    dt = 0.000004
-    h = 0.0005
-    
-    # Grid settings (match visualization)
-    viz_nx = 400
-    viz_ny = 200
-    domain_x = 0.1
-    domain_y = 0.05
-    dx = domain_x / viz_nx
-    dy = domain_y / viz_ny
-
     if not os.path.exists('output_analysis'):
         os.makedirs('output_analysis')
 
-    # Process ALL frames for animation
-    for i, filename in enumerate(files):
-        data = np.load(filename)
-        step = data['step']
-        positions = data['positions']
-        velocities = data['velocities']
-        
-        t = step * dt
-        
-        # Interpolate Vx and Vy
-        grid_vx = render_fluid_grid(positions, velocities[:, 0], h, viz_nx, viz_ny, domain_x, domain_y)
-        grid_vy = render_fluid_grid(positions, velocities[:, 1], h, viz_nx, viz_ny, domain_x, domain_y)
-        
-        # Compute Gradients: dVy/dx - dVx/dy
-        grad_vy = np.gradient(grid_vy, dy, dx)
-        grad_vx = np.gradient(grid_vx, dy, dx)
-        
-        dvy_dx = grad_vy[1]
-        dvx_dy = grad_vx[0]
-        vorticity = dvy_dx - dvx_dy
-        
-        enstrophy = np.sum(vorticity**2) * (dx * dy)
-        
-        steps.append(step)
-        times.append(t)
-        enstrophies.append(enstrophy)
-        
-        # Save Vorticity Map for every frame
-        print(f"Generating Vorticity Map for step {step} ({i+1}/{len(files)})...")
-        plt.figure(figsize=(10, 5), facecolor='black')
-        ax = plt.gca()
-        ax.set_facecolor('black')
-        
-        # Use a fixed scale for animation stability
-        # Based on previous runs, +/- 50 to 100 is a good range for vorticity
-        limit = 100.0 
-        im = plt.imshow(vorticity, origin='lower', extent=[0, domain_x, 0, domain_y], 
-                   cmap='seismic', vmin=-limit, vmax=limit, interpolation='bicubic')
-        
-        plt.axis('off')
-        plt.title(f"Vorticity Field (Step {step})", color='white')
-        
-        cbar = plt.colorbar(im, ax=ax, fraction=0.046, pad=0.04)
-        cbar.ax.yaxis.set_tick_params(color='white')
-        plt.setp(plt.getp(cbar.ax.axes, 'yticklabels'), color='white')
-        cbar.set_label('Vorticity (1/s)', color='white')
-        
-        output_map = f"output_analysis/vorticity_map_{step:05d}.png"
-        plt.tight_layout()
-        plt.savefig(output_map, facecolor='black', edgecolor='none')
-        plt.close()
+    # Process ALL frames for animation; frames are independent, so each
+    # worker reads, renders and writes its own PNGs.
+    tasks = [(i, len(files), filename) for i, filename in enumerate(files)]
+    with ProcessPoolExecutor(max_workers=os.cpu_count(), initializer=_init_worker) as ex:
+        results = sorted(ex.map(process_frame, tasks, chunksize=4))
+
+    steps = [r[0] for r in results]
+    times = [r[1] for r in results]
+    enstrophies = [r[2] for r in results]
 
     # Plot Enstrophy Evolution
     times = np.array(times)
@@ -1,45 +1,84 @@
 import numpy as np
+from numba import njit, prange
 
-def generate_ghost_particles(positions, velocities, masses, densities, colors, rho_refs, h, domain_min, domain_max):
+# Storage type of the per-slot arrays streamed by the SPH kernel. float32 halves the
+# bytes per neighbor visit; pair differences and all sums are still formed in float64.
+SLOT_DTYPE = np.float32
+
+def find_ghost_sources(pos_x, pos_y, band, domain_min, domain_max):
     """
-    Generates 'Ghost Particles' to enforce slip boundary conditions at the walls.
-    Mirrors particles across the boundary with reversed velocity.
+    Finds the real particles within `band` of each wall, i.e. the particles that
+    are mirrored as ghosts across that wall.
+    Returns (source, mirror_dim, mirror_wall): for each ghost, the index of its
+    real particle, the mirrored axis and the wall coordinate (walls in the order
+    left, right, bottom, top).
     """
-    ghost_pos = []
-    ghost_vel = []
-    ghost_mass = []
-    ghost_density = []
-    ghost_color = []
-    ghost_rho_ref = []
-    
-    search_dist = 2.0 * h
+    sources, dims, walls = [], [], []
+    for dim, coord, dmin, dmax in [(0, pos_x, domain_min[0], domain_max[0]), (1, pos_y, domain_min[1], domain_max[1])]:
+        for wall, mask in ((dmin, coord < dmin + band), (dmax, coord > dmax - band)):
+            idx = np.flatnonzero(mask)
+            sources.append(idx)
+            dims.append(np.full(idx.shape[0], dim, dtype=np.int8))
+            walls.append(np.full(idx.shape[0], wall, dtype=np.float64))
+    return (np.concatenate(sources).astype(np.int32), np.concatenate(dims), np.concatenate(walls))
+
+@njit(parallel=True, cache=True)
+def gather_ghosted_state(pos_x, pos_y, vel_x, vel_y, masses, source, mirror_dim, mirror_wall, search_dist, out):
+    """
+    Builds the per-slot particle arrays (SoA) for a fixed ghost layout from the
+    current real state: slot k copies real particle source[k], mirrored across
+    mirror_wall[k] along axis mirror_dim[k] (reversed normal velocity) for a ghost.
+    A ghost whose real particle is no longer within search_dist of the wall gets
+    zero mass, so it drops out of every sum exactly as if it had not been generated.
+    out is a reusable (5, capacity) SLOT_DTYPE buffer with capacity >= len(source);
+    returns views of its rows (pos_x, pos_y, vel_x, vel_y, masses) per slot.
+    Static per-particle fields (rho_refs) only change with the layout and are
+    gathered by the caller when the layout is rebuilt.
+    """
+    n = source.shape[0]
+    slot_x = out[0, :n]
+    slot_y = out[1, :n]
+    slot_vx = out[2, :n]
+    slot_vy = out[3, :n]
+    slot_mass = out[4, :n]
     
-    # Mirroring walls (Left/Right, Bottom/Top)
-    for dim, dmin, dmax in [(0, domain_min[0], domain_max[0]), (1, domain_min[1], domain_max[1])]:
-        # Lower Boundary
-        mask = positions[:, dim] < dmin + search_dist
-        if np.any(mask):
-            p = positions[mask].copy(); p[:, dim] = 2.0 * dmin - p[:, dim]; ghost_pos.append(p)
-            v = velocities[mask].copy(); v[:, dim] = -v[:, dim]; ghost_vel.append(v)
-            ghost_mass.append(masses[mask]); ghost_density.append(densities[mask])
-            ghost_color.append(colors[mask]); ghost_rho_ref.append(rho_refs[mask])
+    for k in prange(n):
+        s = source[k]
+        px = pos_x[s]
+        py = pos_y[s]
+        vx = vel_x[s]
+        vy = vel_y[s]
+        m = masses[s]
         
-        # Upper Boundary
-        mask = positions[:, dim] > dmax - search_dist
-        if np.any(mask):
-            p = positions[mask].copy(); p[:, dim] = 2.0 * dmax - p[:, dim]; ghost_pos.append(p)
-            v = velocities[mask].copy(); v[:, dim] = -v[:, dim]; ghost_vel.append(v)
-            ghost_mass.append(masses[mask]); ghost_density.append(densities[mask])
-            ghost_color.append(colors[mask]); ghost_rho_ref.append(rho_refs[mask])
-
-    if not ghost_pos:
-        return positions, velocities, masses, densities, colors, rho_refs
+        dim = mirror_dim[k]
+        if dim == 0:
+            wall = mirror_wall[k]
+            if abs(px - wall) >= search_dist: m = 0.0
+            px = 2.0 * wall - px
+            vx = -vx
+        elif dim == 1:
+            wall = mirror_wall[k]
+            if abs(py - wall) >= search_dist: m = 0.0
+            py = 2.0 * wall - py
+            vy = -vy
+        
+        slot_x[k] = px
+        slot_y[k] = py
+        slot_vx[k] = vx
+        slot_vy[k] = vy
+        slot_mass[k] = m
+        
+    return slot_x, slot_y, slot_vx, slot_vy, slot_mass
 
-    all_pos = np.vstack([positions] + ghost_pos)
-    all_vel = np.vstack([velocities] + ghost_vel)
-    all_mass = np.concatenate([masses] + ghost_mass)
-    all_dens = np.concatenate([densities] + ghost_density)
-    all_col = np.concatenate([colors] + ghost_color)
-    all_ref = np.concatenate([rho_refs] + ghost_rho_ref)
-    
-    return all_pos, all_vel, all_mass, all_dens, all_col, all_ref
+@njit(inline='always', cache=True)
+def reflect_coordinate(p, v, dmin, dmax):
+    """
+    Reflective wall along one axis: a coordinate outside [dmin, dmax] is mirrored
+    back across the crossed wall and its velocity component reversed and halved.
+    Returns the (possibly) updated (p, v).
+    """
+    if p < dmin:
+        return dmin + (dmin - p), v * -0.5
+    if p > dmax:
+        return dmax - (p - dmax), v * -0.5
+    return p, v
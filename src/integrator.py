@@ -1,4 +1,6 @@
 import numpy as np
+from numba import njit, prange
+from boundaries import reflect_coordinate
 
 def leapfrog_kick(velocities, accelerations, dt):
     """
@@ -29,3 +31,29 @@ def leapfrog_full_step(positions, velocities, accelerations, physics_func, dt, *
     velocities_new = leapfrog_kick(v_half, accelerations_new, dt)
     
     return positions_new, velocities_new, accelerations_new
+
+@njit(parallel=True, cache=True)
+def kick_drift_reflect(pos_x, pos_y, vel_x, vel_y, acc_x, acc_y, dt, domain_min, domain_max):
+    """
+    First half of a Kick-Drift-Kick step, fused into one in-place pass over the
+    per-axis (SoA) arrays:
+    1. v += a(t)*dt/2          -> v(t+dt/2)
+    2. r += v(t+dt/2)*dt       -> r(t+dt)
+    3. reflective walls (boundaries.reflect_coordinate)
+    On return vel_x, vel_y hold v(t+dt/2); finish the step with closing_kick.
+    """
+    half_dt = dt / 2.0
+    for i in prange(pos_x.shape[0]):
+        vx = vel_x[i] + acc_x[i] * half_dt
+        vy = vel_y[i] + acc_y[i] * half_dt
+        pos_x[i], vel_x[i] = reflect_coordinate(pos_x[i] + vx * dt, vx, domain_min[0], domain_max[0])
+        pos_y[i], vel_y[i] = reflect_coordinate(pos_y[i] + vy * dt, vy, domain_min[1], domain_max[1])
+
+@njit(parallel=True, cache=True)
+def closing_kick(vel_x, vel_y, acc_x, acc_y, dt):
+    """
+    v(t+dt) = v(t+dt/2) + a(t+dt)*dt/2, in place on the per-axis arrays.
+    """
+    for i in prange(vel_x.shape[0]):
+        vel_x[i] += 0.5 * acc_x[i] * dt
+        vel_y[i] += 0.5 * acc_y[i] * dt
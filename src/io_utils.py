@@ -3,7 +3,15 @@ import os
 import glob
 import json
 import shutil
+import struct
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from itertools import repeat
 from rti_setup import setup_rayleigh_taylor
+from stats_utils import partition_percentile
+
+# Concurrent checkpoint readers used when rebuilding the analysis history
+IO_WORKERS = 4
 
 def setup_directories(clear=False):
     """Prepares the data and output directories."""
@@ -22,7 +30,7 @@ def setup_directories(clear=False):
         os.makedirs('data')
 
 def save_checkpoint(step, positions, velocities, masses, densities, colors, rho_refs, internal_energy=0.0, data_dir='data'):
-    """Saves the simulation state to a compressed .npz file."""
+    """Saves the simulation state to an uncompressed .npz file (np.savez, no pickled objects)."""
     if not os.path.exists(data_dir):
         os.makedirs(data_dir)
     filename = os.path.join(data_dir, f"checkpoint_{step:05d}.npz")
@@ -43,6 +51,45 @@ def load_latest_checkpoint(data_dir='data'):
     print(f"Loading checkpoint: {latest_file}", flush=True)
     return np.load(latest_file)
 
+def _read_npy_header(f):
+    """Reads an .npy header from an open file. Returns (shape, fortran_order, dtype)."""
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+        return np.lib.format.read_array_header_1_0(f)
+    return np.lib.format.read_array_header_2_0(f)
+
+def load_checkpoint_arrays(filename, keys):
+    """
+    Reads only the requested arrays from a checkpoint archive.
+    np.savez stores members uncompressed, so each one is memory-mapped
+    in place from its offset in the zip: no zip-level CRC pass and no copy,
+    and only the pages actually touched are read. Compressed members fall
+    back to a regular read.
+    Returns a dict {key: array}; a missing key raises KeyError, as with np.load.
+    """
+    arrays = {}
+    with zipfile.ZipFile(filename) as zf, open(filename, 'rb') as fh:
+        for key in keys:
+            zinfo = zf.getinfo(key + '.npy')
+            if zinfo.compress_type != zipfile.ZIP_STORED:
+                with zf.open(zinfo) as f:
+                    arrays[key] = np.lib.format.read_array(f, allow_pickle=False)
+                continue
+                
+            # Skip the local file header to reach the member's .npy bytes
+            fh.seek(zinfo.header_offset)
+            local_header = fh.read(30)
+            name_len, extra_len = struct.unpack('<HH', local_header[26:30])
+            fh.seek(zinfo.header_offset + 30 + name_len + extra_len)
+            
+            shape, fortran_order, dtype = _read_npy_header(fh)
+            if shape == ():
+                arrays[key] = np.fromfile(fh, dtype=dtype, count=1).reshape(())
+            else:
+                arrays[key] = np.memmap(fh, dtype=dtype, mode='r', offset=fh.tell(), shape=shape,
+                                        order='F' if fortran_order else 'C')
+    return arrays
+
 def load_or_init_state(h):
     """
     Loads the latest checkpoint or initializes a new simulation state.
@@ -68,8 +115,61 @@ def load_or_init_state(h):
         pos, vel, mass, dens, col, refs = setup_rayleigh_taylor(h)
         return start_step, pos, vel, mass, dens, col, refs, internal_energy
 
+def _history_entry(filename, dt, g):
+    """
+    Computes one history row (step, t, Ek, Ep, E_int, Etot, width) from a checkpoint.
+    Returns None if the file cannot be read.
+    """
+    try:
+        # Only the arrays the history needs are mapped from the archive (densities and rho_refs are never read)
+        keys = ('step', 'positions', 'velocities', 'masses', 'colors')
+        try:
+            data = load_checkpoint_arrays(filename, keys + ('internal_energy',))
+        except KeyError:
+            # Older checkpoints predate internal energy tracking
+            data = load_checkpoint_arrays(filename, keys)
+        step = int(data['step'])
+        positions = data['positions']
+        velocities = data['velocities']
+        masses = data['masses']
+        colors = data['colors']
+        
+        # Load internal energy if available
+        E_int = float(data['internal_energy']) if 'internal_energy' in data else 0.0
+        
+        t = step * dt
+        
+        # Energy Calculation
+        # |v|^2 per particle without a squared temporary; energies accumulate in float64
+        v_sq = np.einsum('ij,ij->i', velocities, velocities, dtype=np.float64)
+        Ek = 0.5 * np.dot(masses.astype(np.float64), v_sq)
+        Ep = g * np.sum(masses * positions[:, 1], dtype=np.float64)
+        Etot = Ek + Ep + E_int # Total Energy including dissipated heat
+        
+        # Mixing Width Calculation
+        y = positions[:, 1]
+        y_light = y[colors == 0]
+        y_heavy = y[colors == 1]
+        
+        if len(y_light) > 0 and len(y_heavy) > 0:
+            h_bubble = partition_percentile(y_light, 99)
+            h_spike = partition_percentile(y_heavy, 1)
+            width = h_bubble - h_spike
+        else:
+            width = 0.0
+            
+        return step, t, Ek, Ep, E_int, Etot, width
+        
+    except Exception as e:
+        print(f"Error reading {filename}: {e}")
+        return None
+
 def rebuild_history(data_dir='data'):
-    """Reconstructs analysis history from existing checkpoint files."""
+    """
+    Reconstructs analysis history from existing checkpoint files.
+    Checkpoints are read and reduced concurrently (NumPy releases the GIL for
+    file reads and the array reductions); rows are appended in file order.
+    """
     history = {
         'step': [], 'time': [],
         'Ek': [], 'Ep': [], 'Eint': [], 'Etot': [],
@@ -85,39 +185,15 @@ def rebuild_history(data_dir='data'):
     dt = 0.000004
     g = 100.0 # Standard gravity for potential energy calc
     
-    for i, filename in enumerate(files):
-        if i % 10 == 0:
-            print(f"  Processed {i}/{len(files)} checkpoints...", flush=True)
-        try:
-            data = np.load(filename)
-            step = int(data['step'])
-            positions = data['positions']
-            velocities = data['velocities']
-            masses = data['masses']
-            colors = data['colors']
+    with ThreadPoolExecutor(max_workers=IO_WORKERS) as pool:
+        entries = pool.map(_history_entry, files, repeat(dt), repeat(g))
+        for i, entry in enumerate(entries):
+            if i % 10 == 0:
+                print(f"  Processed {i}/{len(files)} checkpoints...", flush=True)
+            if entry is None:
+                continue
             
-            # Load internal energy if available
-            E_int = float(data['internal_energy']) if 'internal_energy' in data else 0.0
-            
-            t = step * dt
-            
-            # Energy Calculation
-            v_sq = np.sum(velocities**2, axis=1)
-            Ek = 0.5 * np.sum(masses * v_sq)
-            Ep = np.sum(masses * g * positions[:, 1])
-            Etot = Ek + Ep + E_int # Total Energy including dissipated heat
-            
-            # Mixing Width Calculation
-            pos_light = positions[colors == 0]
-            pos_heavy = positions[colors == 1]
-            
-            if len(pos_light) > 0 and len(pos_heavy) > 0:
-                h_bubble = np.percentile(pos_light[:, 1], 99)
-                h_spike = np.percentile(pos_heavy[:, 1], 1)
-                width = h_bubble - h_spike
-            else:
-                width = 0.0
-                
+            step, t, Ek, Ep, E_int, Etot, width = entry
             history['step'].append(step)
             history['time'].append(t)
             history['Ek'].append(Ek)
@@ -126,7 +202,4 @@ def rebuild_history(data_dir='data'):
             history['Etot'].append(Etot)
             history['mixing_width'].append(width)
             
-        except Exception as e:
-            print(f"Error reading {filename}: {e}")
-            
     return history
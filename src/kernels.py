@@ -4,54 +4,62 @@ from numba import njit
 # Normalization prefactor for 2D Cubic Spline
 KERNEL_PREFACTOR_2D = 10.0 / (7.0 * np.pi)
 
-@njit
-def cubic_spline_kernel(r, h):
+# These kernels are inlined into the cached physics kernels. Numba only checks the
+# caller's source file for staleness, so clear src/__pycache__ after editing them.
+
+@njit(inline='always', fastmath=True, cache=True)
+def cubic_spline_kernel(r2, inv_h2, sigma):
     """
     Computes the cubic spline kernel value W(r, h).
     This function represents the spatial weighting of particle interactions.
+    The support test is done on q^2, so pairs outside 2h never take a sqrt.
     
     Parameters:
-    r (float): Distance between particles.
-    h (float): Smoothing length.
+    r2 (float): Squared distance between particles.
+    inv_h2 (float): 1 / h^2, with h the smoothing length.
+    sigma (float): Normalization KERNEL_PREFACTOR_2D / h^2.
     
     Returns:
     float: Kernel value.
     """
-    q = r / h
-    sigma = KERNEL_PREFACTOR_2D / (h**2)
+    q2 = r2 * inv_h2
     
-    if q < 1:
-        return sigma * (1.0 - 1.5 * q**2 + 0.75 * q**3)
-    elif q < 2:
-        return sigma * 0.25 * (2.0 - q)**3
+    # Explicit products instead of ** so no pow() call is emitted
+    if q2 < 1.0:
+        q = np.sqrt(q2)
+        return sigma * (1.0 - 1.5 * q2 + 0.75 * q2 * q)
+    elif q2 < 4.0:
+        t = 2.0 - np.sqrt(q2)
+        return sigma * 0.25 * t * t * t
     return 0.0
 
-@njit
-def cubic_spline_kernel_grad(r_vec, h):
+@njit(inline='always', fastmath=True, cache=True)
+def cubic_spline_kernel_grad(rx, ry, r2, inv_h2, sigma):
     """
     Computes the gradient of the cubic spline kernel \nabla W(r, h).
     Used for calculating forces (pressure gradient, viscosity).
+    Returns scalars so the force loop never allocates per neighbor pair.
+    
+    The gradient is r_ij * (dW/dr) / r, and the 1/r is folded into the polynomial:
+    q < 1:  (dW/dr) / r = sigma / h^2 * (-3 + 2.25 q)        (no division)
+    q < 2:  (dW/dr) / r = sigma / h^2 * (-0.75 (2 - q)^2) / q
     
     Parameters:
-    r_vec (np.array): Vector pointing from particle j to i (r_ij).
-    h (float): Smoothing length.
+    rx, ry (float): Components of the vector pointing from particle j to i (r_ij).
+    r2 (float): Its squared length.
+    inv_h2 (float): 1 / h^2, with h the smoothing length.
+    sigma (float): Normalization KERNEL_PREFACTOR_2D / h^2.
     
     Returns:
-    np.array: Gradient vector.
+    tuple: Gradient components (gx, gy).
     """
-    r = np.sqrt(r_vec[0]**2 + r_vec[1]**2)
-    q = r / h
-    sigma = KERNEL_PREFACTOR_2D / (h**2)
-    
-    if r > 1e-12:
-        direction = r_vec / r
-    else:
-        return np.zeros(2)
+    q = np.sqrt(r2 * inv_h2)
     
     if q < 1:
-        val = sigma * (1.0/h) * (-3.0*q + 2.25*q**2)
-        return val * direction
+        f = sigma * inv_h2 * (-3.0 + 2.25*q)
     elif q < 2:
-        val = sigma * (1.0/h) * (-0.75 * (2.0 - q)**2)
-        return val * direction
-    return np.zeros(2)
+        t = 2.0 - q
+        f = sigma * inv_h2 * (-0.75 * t * t) / q
+    else:
+        return 0.0, 0.0
+    return f * rx, f * ry
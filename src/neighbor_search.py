@@ -1,44 +1,224 @@
 import numpy as np
-from numba import njit
+from numba import njit, prange
+from boundaries import find_ghost_sources
 
-@njit
-def get_cell_id(pos, domain_min, grid_size, n_cells_x, n_cells_y):
+GRID_SEARCH_RADIUS = 1  # Number of cells to search in each direction (Moore neighborhood of rank 1)
+
+@njit(inline='always', cache=True)
+def _spread_bits(v):
     """
-    Calculates the 1D grid cell index for a particle position.
-    Used for the spatial hashing neighbor search.
+    Spreads the low 16 bits of v to the even bit positions (0b1011 -> 0b1000101).
+    Works on scalars inside kernels and elementwise on integer arrays.
     """
-    ix = int((pos[0] - domain_min[0]) / grid_size)
-    iy = int((pos[1] - domain_min[1]) / grid_size)
-    ix = max(0, min(ix, n_cells_x - 1))
-    iy = max(0, min(iy, n_cells_y - 1))
-    return ix + iy * n_cells_x
+    v = v & 0x0000ffff
+    v = (v | (v << 8)) & 0x00ff00ff
+    v = (v | (v << 4)) & 0x0f0f0f0f
+    v = (v | (v << 2)) & 0x33333333
+    v = (v | (v << 1)) & 0x55555555
+    return v
 
-def build_grid(positions, domain_min, domain_max, grid_size):
+@njit(inline='always', cache=True)
+def morton2(ix, iy):
+    """
+    Z-order (Morton) index of grid cell (ix, iy): the bits of ix and iy interleaved.
+    Cells that are close in 2D get close 1D ids, so the 3x3 neighbor scan reads
+    nearby entries of cell_offsets instead of three rows n_cells_x apart.
+    """
+    return _spread_bits(ix) | (_spread_bits(iy) << 1)
+
+@njit(cache=True)
+def _scatter_by_cell(cell_ids, cell_offsets):
+    """
+    Counting-sort scatter: places each particle index in the next free slot of its
+    cell, giving sorted_indices in O(n) (stable, ascending index within a cell).
+    """
+    next_slot = cell_offsets[:-1].copy()
+    sorted_indices = np.empty(cell_ids.shape[0], dtype=np.int32)
+    for i in range(cell_ids.shape[0]):
+        c = cell_ids[i]
+        sorted_indices[next_slot[c]] = i
+        next_slot[c] += 1
+    return sorted_indices
+
+def build_grid(pos_x, pos_y, domain_min, domain_max, grid_size):
     """
     Builds the spatial hash grid for neighbor searching.
     Returns cell offsets and sorted particle indices.
     """
-    n = positions.shape[0]
     n_cells_x = int(np.ceil((domain_max[0] - domain_min[0]) / grid_size)) + 1
     n_cells_y = int(np.ceil((domain_max[1] - domain_min[1]) / grid_size)) + 1
-    n_cells = n_cells_x * n_cells_y
-    
-    cell_ids = np.zeros(n, dtype=np.int32)
-    # Numba optimization for loop if possible, but this part mixes numpy and loops.
-    # We can keep it simple or wrap the loop in njit if needed.
-    # For now, sticking to the previous implementation logic.
-    
-    # We can use the njit version of get_cell_id in a loop here, or vectorise if possible.
-    # The previous implementation had a loop calling get_cell_id.
+    # Morton ids cover the enclosing power-of-two square of cells
+    side = 1 << (max(n_cells_x, n_cells_y) - 1).bit_length()
+    n_cells = side * side
     
-    for i in range(n):
-        cell_ids[i] = get_cell_id(positions[i], domain_min, grid_size, n_cells_x, n_cells_y)
-        
-    sorted_indices = np.argsort(cell_ids).astype(np.int32)
-    sorted_cell_ids = cell_ids[sorted_indices]
+    # Cell coordinates for all particles at once; ghosts outside the domain are clamped to the edge cells
+    ix = np.clip(((pos_x - domain_min[0]) / grid_size).astype(np.int32), 0, n_cells_x - 1)
+    iy = np.clip(((pos_y - domain_min[1]) / grid_size).astype(np.int32), 0, n_cells_y - 1)
+    cell_ids = morton2(ix, iy)
     
+    # Counting sort: cell ids are small integers, so bucket them instead of argsort
     cell_offsets = np.zeros(n_cells + 1, dtype=np.int32)
-    counts = np.bincount(sorted_cell_ids, minlength=n_cells)
-    cell_offsets[1:] = np.cumsum(counts)
+    counts = np.bincount(cell_ids, minlength=n_cells)
+    np.cumsum(counts, out=cell_offsets[1:])
+    sorted_indices = _scatter_by_cell(cell_ids, cell_offsets)
     
     return n_cells_x, n_cells_y, cell_offsets, sorted_indices
+
+@njit(inline='always', cache=True)
+def _compact_bits(v):
+    """Inverse of _spread_bits: gathers the even bits of v into the low 16 bits."""
+    v = v & 0x55555555
+    v = (v | (v >> 1)) & 0x33333333
+    v = (v | (v >> 2)) & 0x0f0f0f0f
+    v = (v | (v >> 4)) & 0x00ff00ff
+    v = (v | (v >> 8)) & 0x0000ffff
+    return v
+
+@njit(inline='always', cache=True)
+def _scan_cell(cell, pos_x, pos_y, n_cells_x, n_cells_y, cell_offsets, radius2, fill, offsets, out):
+    """
+    Lists the neighbors of every particle in one grid cell. The particle ranges
+    of the 3x3 neighbor cells are looked up once and shared by all particles of
+    the cell. Counts into offsets[i + 1] if not fill, else writes the indices to
+    out[offsets[i]:].
+    """
+    ix = _compact_bits(cell)
+    iy = _compact_bits(cell >> 1)
+    
+    # Neighbor block clamped to the grid up front, so no per-cell bounds test
+    x_lo = max(ix - GRID_SEARCH_RADIUS, 0)
+    x_hi = min(ix + GRID_SEARCH_RADIUS, n_cells_x - 1)
+    y_lo = max(iy - GRID_SEARCH_RADIUS, 0)
+    y_hi = min(iy + GRID_SEARCH_RADIUS, n_cells_y - 1)
+    
+    # Particle ranges of the block; cells adjacent in Morton order merge into one span
+    starts = np.empty(9, dtype=np.int64)
+    ends = np.empty(9, dtype=np.int64)
+    n_ranges = 0
+    for nx_idx in range(x_lo, x_hi + 1):
+        for ny_idx in range(y_lo, y_hi + 1):
+            cell_id = morton2(nx_idx, ny_idx)
+            start = cell_offsets[cell_id]
+            end = cell_offsets[cell_id + 1]
+            if start == end:
+                continue
+            if n_ranges > 0 and ends[n_ranges - 1] == start:
+                ends[n_ranges - 1] = end
+            else:
+                starts[n_ranges] = start
+                ends[n_ranges] = end
+                n_ranges += 1
+    
+    for i in range(cell_offsets[cell], cell_offsets[cell + 1]):
+        c = 0
+        for r in range(n_ranges):
+            for j in range(starts[r], ends[r]):
+                if j == i: continue
+                dx_v = pos_x[i] - pos_x[j]
+                dy_v = pos_y[i] - pos_y[j]
+                if dx_v * dx_v + dy_v * dy_v < radius2:
+                    if fill:
+                        out[offsets[i] + c] = j
+                    c += 1
+        if not fill:
+            offsets[i + 1] = c
+
+@njit(parallel=True, cache=True)
+def build_pair_list(pos_x, pos_y, n_cells_x, n_cells_y, cell_offsets, radius):
+    """
+    Builds a CSR neighbor list from the cell grid: for every particle (arrays in
+    cell order, as sorted by build_grid), the indices of all other particles
+    closer than radius (the grid's cell size). Counts per particle first, then
+    fills at the prefix-sum offsets, so the list is allocated once at its exact size.
+    Threads take whole cells, so each cell's neighbor ranges are read once.
+    Returns (offsets, neighbors): the neighbors of i are neighbors[offsets[i]:offsets[i+1]].
+    """
+    n = pos_x.shape[0]
+    n_cells = cell_offsets.shape[0] - 1
+    radius2 = radius * radius
+    
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    no_output = np.empty(0, dtype=np.int32)
+    for cell in prange(n_cells):
+        if cell_offsets[cell] < cell_offsets[cell + 1]:
+            _scan_cell(cell, pos_x, pos_y, n_cells_x, n_cells_y, cell_offsets, radius2,
+                       False, offsets, no_output)
+    
+    offsets = np.cumsum(offsets)
+    neighbors = np.empty(offsets[n], dtype=np.int32)
+    for cell in prange(n_cells):
+        if cell_offsets[cell] < cell_offsets[cell + 1]:
+            _scan_cell(cell, pos_x, pos_y, n_cells_x, n_cells_y, cell_offsets, radius2,
+                       True, offsets, neighbors)
+    
+    return offsets, neighbors
+
+@njit(parallel=True, cache=True)
+def max_displacement_sq(pos_x, pos_y, ref_x, ref_y):
+    """Largest squared distance any particle has moved from its reference position."""
+    d_max = 0.0
+    for i in prange(pos_x.shape[0]):
+        dx = pos_x[i] - ref_x[i]
+        dy = pos_y[i] - ref_y[i]
+        d_max = max(d_max, dx * dx + dy * dy)
+    return d_max
+
+class NeighborList:
+    """
+    Verlet neighbor list over real and ghost particles, reused across steps.
+    
+    Every pair closer than 2h + skin is listed, and ghosts are laid out for a
+    wall band of 2h + skin. The list stays valid while no particle has moved more
+    than skin / 2 since the build: no unlisted pair can close the gap to 2h, and
+    no particle outside the listed ghost band can come within 2h of a wall.
+    
+    Slots are in cell (Morton) order. Per slot: source (index of the real
+    particle), mirror_dim (-1 for the real particle itself, else the mirrored
+    axis), mirror_wall (wall coordinate) and particle_ids (source for real
+    particles, -1 for ghosts).
+    """
+    def __init__(self, h, domain_min, domain_max, skin):
+        self.cutoff = 2.0 * h
+        self.skin = skin
+        self.domain_min = domain_min
+        self.domain_max = domain_max
+        self.ref_x = None
+        self.ref_y = None
+        
+    def needs_rebuild(self, pos_x, pos_y):
+        """True if the list was never built or some particle moved more than skin / 2."""
+        if self.ref_x is None or self.ref_x.shape != pos_x.shape:
+            return True
+        return max_displacement_sq(pos_x, pos_y, self.ref_x, self.ref_y) > (0.5 * self.skin)**2
+        
+    def build(self, pos_x, pos_y):
+        """Lays out the ghosts, sorts all slots by cell and lists the pairs for (pos_x, pos_y)."""
+        radius = self.cutoff + self.skin
+        n = pos_x.shape[0]
+        
+        # Real particles followed by the ghosts of each wall
+        g_src, g_dim, g_wall = find_ghost_sources(pos_x, pos_y, radius, self.domain_min, self.domain_max)
+        source = np.concatenate((np.arange(n, dtype=np.int32), g_src))
+        mirror_dim = np.concatenate((np.full(n, -1, dtype=np.int8), g_dim))
+        mirror_wall = np.concatenate((np.zeros(n), g_wall))
+        
+        all_x = pos_x[source]
+        all_y = pos_y[source]
+        for dim, coord in ((0, all_x), (1, all_y)):
+            sel = mirror_dim == dim
+            coord[sel] = 2.0 * mirror_wall[sel] - coord[sel]
+        
+        # Grid with cells of the list radius; slots take the grid's cell order
+        n_cells_x, n_cells_y, cell_offsets, order = build_grid(
+            all_x, all_y, self.domain_min, self.domain_max, radius
+        )
+        self.source = source[order]
+        self.mirror_dim = mirror_dim[order]
+        self.mirror_wall = mirror_wall[order]
+        self.particle_ids = np.where(self.mirror_dim < 0, self.source, -1).astype(np.int32)
+        
+        self.offsets, self.neighbors = build_pair_list(
+            all_x[order], all_y[order], n_cells_x, n_cells_y, cell_offsets, radius
+        )
+        self.ref_x = pos_x.copy()
+        self.ref_y = pos_y.copy()
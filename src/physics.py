@@ -9,25 +9,32 @@ MIN_DENSITY = 0.1       # Threshold to ignore vacuum/invalid particles
 VISCOSITY_EPSILON = 0.01 # Small factor in viscosity to prevent division by zero
 KERNEL_CUTOFF_SQ_FACTOR = 4.0 # (2h)^2 = 4h^2
 MIN_DIST_SQ = 1e-18     # Minimum squared distance to avoid division by zero
-GRID_SEARCH_RADIUS = 1  # Number of cells to search in each direction (Moore neighborhood of rank 1)
 
-@njit
-def calculate_pressure_force(p_i, p_j, rho_i, rho_j, m_j, grad_w):
+# fastmath without 'nnan'/'ninf': the density validity test must keep rejecting NaN,
+# which LLVM would be free to assume away under the full fastmath flag set.
+FASTMATH_FLAGS = {'nsz', 'arcp', 'contract', 'afn', 'reassoc'}
+
+@njit(inline='always', fastmath=FASTMATH_FLAGS, cache=True)
+def calculate_pressure_force(p_i, p_j, rho_i, rho_j, gx, gy):
     """
-    Calculates the symmetrical pressure gradient force contribution from particle j on i.
-    F_p = - m_j * (P_i/rho_i^2 + P_j/rho_j^2) * \nabla W
+    Calculates the symmetrical pressure gradient pair term between particles i and j.
+    f_p = - (P_i/rho_i^2 + P_j/rho_j^2) * \nabla W_ij
+    The acceleration of i is m_j * f_p and that of j is -m_i * f_p.
+    Returns the components (fx, fy) as scalars.
     """
     p_term = (p_i / rho_i**2 + p_j / rho_j**2)
-    return -m_j * p_term * grad_w
+    return -p_term * gx, -p_term * gy
 
-@njit
-def calculate_viscosity_force(r_vec, v_vec, r2, rho_i, rho_j, m_j, h, alpha, beta, grad_w):
+@njit(inline='always', fastmath=FASTMATH_FLAGS, cache=True)
+def calculate_viscosity_force(rx, ry, vx, vy, r2, rho_i, rho_j, h, alpha, beta, gx, gy):
     """
-    Calculates the Monaghan artificial viscosity force contribution.
+    Calculates the Monaghan artificial viscosity pair term between particles i and j.
     Dampens shockwaves and stabilizes numerical oscillations.
+    (rx, ry) is r_ij, (vx, vy) is v_ij; returns the components (fx, fy) as scalars,
+    applied like the pressure term (m_j * f to i, -m_i * f to j).
     """
     # Dot product of velocity difference and position difference
-    v_dot_r = v_vec[0] * r_vec[0] + v_vec[1] * r_vec[1]
+    v_dot_r = vx * rx + vy * ry
     
     if v_dot_r < 0:
         # Viscosity is only applied when particles are approaching each other
@@ -36,147 +43,167 @@ def calculate_viscosity_force(r_vec, v_vec, r2, rho_i, rho_j, m_j, h, alpha, bet
         
         # Viscosity term \Pi_{ij}
         phi = (-alpha * SOUND_SPEED * mu + beta * mu**2) / rho_bar
-        return -m_j * phi * grad_w
+        return -phi * gx, -phi * gy
         
-    return np.zeros(2)
+    return 0.0, 0.0
+
+@njit(inline='always', cache=True)
+def _clear_rows_through(buf, end, r):
+    """
+    Extends the cleared row range [.., end) of a chunk buffer to cover row r,
+    zeroing the rows added. Returns the new exclusive end.
+    """
+    if r >= end:
+        buf[end:r + 1] = 0.0
+        return r + 1
+    return end
 
-@njit(parallel=True)
-def compute_density(positions, masses, h, domain_min, grid_size, n_cells_x, n_cells_y, cell_offsets, sorted_indices):
+@njit(parallel=True, fastmath=FASTMATH_FLAGS, cache=True)
+def compute_density_and_forces(pos_x, pos_y, vel_x, vel_y, masses, rho_refs, p0, h, gravity,
+                               nbr_offsets, nbr_indices, particle_ids, n_active, acc_buf, power_buf,
+                               alpha=0.1, beta=0.0):
     """
-    Computes the density \rho_i for each particle using SPH summation.
+    Computes density, pressure and accelerations from a precomputed neighbor list.
     
-    \rho_i = \sum_j m_j W(r_{ij}, h)
+    Particles are given per slot, real particles and ghosts alike (see
+    neighbor_search.NeighborList), typically as float32 (boundaries.SLOT_DTYPE);
+    each pair separation is widened to float64 before use, and all sums and the
+    accumulation buffers are float64 (the returned densities and accelerations are
+    stored as float32). The candidates of slot i are
+    nbr_indices[nbr_offsets[i]:nbr_offsets[i+1]], a superset of the particles
+    inside the 2h cutoff. particle_ids[k] is the original index of the real
+    particle in slot k, or -1 for a ghost.
     
-    Uses a grid-based neighbor search for efficiency.
+    Pass 1 (all slots):
+        \rho_i = \sum_j m_j W(r_{ij}, h)
+        P_i = P_0 * ((\rho_i / \rho_{ref,i})^\gamma - 1)
+    
+    Pass 2 (real particles): pressure gradient and artificial viscosity. Each
+    real-real pair is evaluated once, from its lower slot, and applied to both
+    particles (Newton's third law); ghosts only act on the real particle.
+    The viscous power of a pair, -m_i m_j f_visc . (v_i - v_j) (v_j = 0 for a
+    ghost, whose reaction is not applied), is summed in the same visit.
+    Contiguous chunks of slots run in parallel and scatter into their own
+    accumulation buffers, which are summed, together with gravity, in a final pass.
+    The buffers are reused across calls and set the chunk count (normally the
+    thread count): acc_buf is (n_chunks, capacity, 2) float64 with capacity >= the
+    number of slots; power_buf is (n_chunks,). A chunk only scatters to rows from
+    its first slot up to its highest real neighbor, so it clears rows as its range
+    grows, and the final pass only reads the chunks whose range covers a slot.
+    Returns (in original particle order):
+    densities: (n_active,) float32
+    accelerations: (2, n_active) float32, rows a_x and a_y
+    viscosity_power: total power dissipated by viscosity (W)
     """
-    n = positions.shape[0]
-    densities = np.zeros(n)
-    h2 = h**2
+    n = pos_x.shape[0]
+    densities = np.zeros(n_active, dtype=np.float32)
+    # Density, pressure and validity flag per slot, read by the force pass
+    rho = np.zeros(n)
+    pressures = np.zeros(n)
+    valid = np.empty(n, dtype=np.uint8)
+    accelerations = np.zeros((2, n_active), dtype=np.float32)
+    # Smoothing-length factors, hoisted out of the pair loops
+    inv_h = 1.0 / h
+    inv_h2 = inv_h * inv_h
+    sigma = KERNEL_PREFACTOR_2D * inv_h2
+    cutoff2 = KERNEL_CUTOFF_SQ_FACTOR * h * h
     
+    # Pass 1: density and pressure
     for i in prange(n):
-        ix = int((positions[i, 0] - domain_min[0]) / grid_size)
-        iy = int((positions[i, 1] - domain_min[1]) / grid_size)
+        # Self contribution, then the listed neighbors inside the cutoff radius 2h
+        d_i = np.float64(masses[i]) * cubic_spline_kernel(0.0, inv_h2, sigma)
+        for k in range(nbr_offsets[i], nbr_offsets[i + 1]):
+            j = nbr_indices[k]
+            dx_v = np.float64(pos_x[i]) - np.float64(pos_x[j])
+            dy_v = np.float64(pos_y[i]) - np.float64(pos_y[j])
+            r2 = dx_v**2 + dy_v**2
+            if r2 < cutoff2:
+                d_i += masses[j] * cubic_spline_kernel(r2, inv_h2, sigma)
         
-        d_i = 0.0
-        # Iterate over neighboring cells within search radius
-        for dx in range(-GRID_SEARCH_RADIUS, GRID_SEARCH_RADIUS + 1):
-            for dy in range(-GRID_SEARCH_RADIUS, GRID_SEARCH_RADIUS + 1):
-                nx_idx = ix + dx
-                ny_idx = iy + dy
+        rho[i] = d_i
+        pressures[i] = p0 * ((d_i / rho_refs[i])**EOS_GAMMA - 1)
+        # Vacuum/invalid particles take no part in the forces (the comparison is also False for NaN)
+        valid[i] = 1 if d_i >= MIN_DENSITY else 0
+        if particle_ids[i] >= 0:
+            densities[particle_ids[i]] = d_i
+    
+    # Pass 2: pair forces, each real-real pair once.
+    # Per slot: a_x, a_y; per chunk: the dissipated power
+    n_chunks = acc_buf.shape[0]
+    chunk_size = (n + n_chunks - 1) // n_chunks
+    
+    # Rows [c * chunk_size, chunk_end[c]) of acc_buf[c] are in use (cleared, then accumulated)
+    chunk_end = np.empty(n_chunks, dtype=np.int64)
+    
+    for c in prange(n_chunks):
+        buf = acc_buf[c]
+        end = c * chunk_size
+        power = 0.0
+        for i in range(c * chunk_size, min(n, (c + 1) * chunk_size)):
+            if particle_ids[i] < 0: continue # Ghosts only act as neighbors
+            if not valid[i]: continue
+            end = _clear_rows_through(buf, end, i)
+            
+            for k in range(nbr_offsets[i], nbr_offsets[i + 1]):
+                j = nbr_indices[k]
+                j_real = particle_ids[j] >= 0
+                if j_real and j < i: continue # Already applied from slot j
+                if not valid[j]: continue
+                
+                dx_vec = np.float64(pos_x[i]) - np.float64(pos_x[j])
+                dy_vec = np.float64(pos_y[i]) - np.float64(pos_y[j])
+                r2 = dx_vec**2 + dy_vec**2
+                # Self and coincident pairs exert no force
+                if r2 >= cutoff2 or r2 <= MIN_DIST_SQ: continue
+                gx, gy = cubic_spline_kernel_grad(dx_vec, dy_vec, r2, inv_h2, sigma)
+                
+                # 1. Pressure Force
+                fpx, fpy = calculate_pressure_force(
+                    pressures[i], pressures[j], rho[i], rho[j], gx, gy
+                )
+                # 2. Artificial Viscosity
+                dvx = np.float64(vel_x[i]) - np.float64(vel_x[j])
+                dvy = np.float64(vel_y[i]) - np.float64(vel_y[j])
+                fvx, fvy = calculate_viscosity_force(
+                    dx_vec, dy_vec, dvx, dvy, r2, rho[i], rho[j], h, alpha, beta, gx, gy
+                )
                 
-                # Check grid bounds
-                if nx_idx >= 0 and nx_idx < n_cells_x and ny_idx >= 0 and ny_idx < n_cells_y:
-                    cell_id = nx_idx + ny_idx * n_cells_x
-                    start = cell_offsets[cell_id]
-                    end = cell_offsets[cell_id + 1]
-                    
-                    # Iterate over particles in cell
-                    for j_ptr in range(start, end):
-                        j = sorted_indices[j_ptr]
-                        dx_v = positions[i, 0] - positions[j, 0]
-                        dy_v = positions[i, 1] - positions[j, 1]
-                        r2 = dx_v**2 + dy_v**2
-                        
-                        if r2 < KERNEL_CUTOFF_SQ_FACTOR * h2: # Cutoff radius 2h
-                            r = np.sqrt(r2)
-                            d_i += masses[j] * cubic_spline_kernel(r, h)
+                m_i = np.float64(masses[i])
+                m_j = np.float64(masses[j])
+                buf[i, 0] += m_j * (fpx + fvx)
+                buf[i, 1] += m_j * (fpy + fvy)
+                
+                # Equal and opposite reaction on a real neighbor
+                if j_real:
+                    end = _clear_rows_through(buf, end, j)
+                    buf[j, 0] -= m_i * (fpx + fvx)
+                    buf[j, 1] -= m_i * (fpy + fvy)
+                else:
+                    # The ghost does no work: only v_i counts
+                    dvx = np.float64(vel_x[i])
+                    dvy = np.float64(vel_y[i])
+                
+                # Viscosity acts as friction; the dissipated (positive) power is minus its work rate
+                power -= m_i * m_j * (fvx * dvx + fvy * dvy)
         
-        densities[i] = d_i
-            
-    return densities
-
-@njit
-def compute_pressure(densities, rho_refs, p0, gamma=EOS_GAMMA):
-    """
-    Computes pressure using the Tait Equation of State (EOS).
-    P_i = P_0 * ((\rho_i / \rho_{ref,i})^\gamma - 1)
-    """
-    return p0 * ((densities / rho_refs)**gamma - 1)
-
-@njit(parallel=True)
-def compute_forces(positions, velocities, densities, pressures, masses, h, gravity, 
-                   domain_min, grid_size, n_cells_x, n_cells_y, 
-                   cell_offsets, sorted_indices, n_active,
-                   alpha=0.1, beta=0.0):
-    """
-    Computes acceleration for each particle due to:
-    1. Pressure Gradient
-    2. Artificial Viscosity
-    3. External Gravity
-    Returns:
-    accelerations: (n_active, 2)
-    viscosity_power: (n_active,) - Power dissipated by viscosity (W)
-    """
-    accelerations = np.zeros((n_active, 2))
-    viscosity_power = np.zeros(n_active)
-    h2 = h**2
+        power_buf[c] = power
+        chunk_end[c] = end
     
-    for i in prange(n_active):
-        # Local accumulation for viscosity to compute work
-        acc_visc_x = 0.0
-        acc_visc_y = 0.0
-        
-        # 1. Gravity
-        accelerations[i, 0] = gravity[0]
-        accelerations[i, 1] = gravity[1]
-        
-        if np.isnan(densities[i]) or densities[i] < MIN_DENSITY: continue
-        
-        ix = int((positions[i, 0] - domain_min[0]) / grid_size)
-        iy = int((positions[i, 1] - domain_min[1]) / grid_size)
-        
-        # Neighbor search
-        for dx in range(-GRID_SEARCH_RADIUS, GRID_SEARCH_RADIUS + 1):
-            for dy in range(-GRID_SEARCH_RADIUS, GRID_SEARCH_RADIUS + 1):
-                nx_idx = ix + dx
-                ny_idx = iy + dy
-                
-                if nx_idx >= 0 and nx_idx < n_cells_x and ny_idx >= 0 and ny_idx < n_cells_y:
-                    cell_id = nx_idx + ny_idx * n_cells_x
-                    start = cell_offsets[cell_id]
-                    end = cell_offsets[cell_id + 1]
-                    
-                    for j_ptr in range(start, end):
-                        j = sorted_indices[j_ptr]
-                        if i == j: continue # Skip self
-                        if np.isnan(densities[j]) or densities[j] < MIN_DENSITY: continue
-                        
-                        dx_vec = positions[i, 0] - positions[j, 0]
-                        dy_vec = positions[i, 1] - positions[j, 1]
-                        r2 = dx_vec**2 + dy_vec**2
-                        
-                        if r2 < KERNEL_CUTOFF_SQ_FACTOR * h2 and r2 > MIN_DIST_SQ:
-                            r = np.sqrt(r2)
-                            r_v = np.array([dx_vec, dy_vec])
-                            grad_w = cubic_spline_kernel_grad(r_v, h)
-                            
-                            # 2. Pressure Force
-                            f_pressure = calculate_pressure_force(
-                                pressures[i], pressures[j], densities[i], densities[j], masses[j], grad_w
-                            )
-                            accelerations[i] += f_pressure
-                            
-                            # 3. Artificial Viscosity
-                            v_vec = np.array([velocities[i, 0] - velocities[j, 0], 
-                                              velocities[i, 1] - velocities[j, 1]])
-                            
-                            f_viscosity = calculate_viscosity_force(
-                                r_v, v_vec, r2, densities[i], densities[j], masses[j], h, alpha, beta, grad_w
-                            )
-                            accelerations[i] += f_viscosity
-                            acc_visc_x += f_viscosity[0]
-                            acc_visc_y += f_viscosity[1]
-                                
-                             
-        # Compute dissipated power for particle i: P = - F_visc . v_i
-        # F_visc = m_i * a_visc
-        # We use v_i (which is v_half in the solver call)
+    # Reduce the chunk buffers and add gravity
+    for i in prange(n):
+        pid = particle_ids[i]
+        if pid < 0: continue
         
-        # Note: Viscosity acts as friction, so F_visc . v is generally negative (removing energy).
-        # We want the positive amount of energy converted to heat (dissipated).
-        # Dissipated Power = - (m_i * a_visc . v_i)
+        acc_x = gravity[0]
+        acc_y = gravity[1]
+        for c in range(n_chunks):
+            if c * chunk_size <= i < chunk_end[c]:
+                acc_x += acc_buf[c, i, 0]
+                acc_y += acc_buf[c, i, 1]
         
-        v_dot_a = acc_visc_x * velocities[i, 0] + acc_visc_y * velocities[i, 1]
-        viscosity_power[i] = -masses[i] * v_dot_a
+        accelerations[0, pid] = acc_x
+        accelerations[1, pid] = acc_y
+    
+    viscosity_power = np.sum(power_buf)
         
-    return accelerations, viscosity_power
+    return densities, accelerations, viscosity_power
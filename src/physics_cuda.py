@@ -0,0 +1,201 @@
+import math
+import numpy as np
+from numba import cuda
+from kernels import cubic_spline_kernel, cubic_spline_kernel_grad, KERNEL_PREFACTOR_2D
+from physics import (EOS_GAMMA, MIN_DENSITY, KERNEL_CUTOFF_SQ_FACTOR, MIN_DIST_SQ,
+                     calculate_pressure_force, calculate_viscosity_force)
+from boundaries import SLOT_DTYPE
+
+# GPU backend for the ghost gather, density, pressure and force passes.
+# Same inputs and results as boundaries.gather_ghosted_state followed by
+# physics.compute_density_and_forces, with one CUDA thread per slot. The neighbor
+# list is still built on the host and only uploaded when it is rebuilt.
+
+THREADS_PER_BLOCK = 128
+
+# On-device sum of the per-particle viscous power
+_sum_reduce = cuda.reduce(lambda a, b: a + b)
+
+@cuda.jit
+def _gather_kernel(pos_x, pos_y, vel_x, vel_y, masses, source, mirror_dim, mirror_wall, search_dist,
+                   slot_x, slot_y, slot_vx, slot_vy, slot_mass):
+    """Device version of boundaries.gather_ghosted_state."""
+    k = cuda.grid(1)
+    if k >= source.shape[0]:
+        return
+    s = source[k]
+    px = pos_x[s]
+    py = pos_y[s]
+    vx = vel_x[s]
+    vy = vel_y[s]
+    m = masses[s]
+
+    dim = mirror_dim[k]
+    if dim == 0:
+        wall = mirror_wall[k]
+        if abs(px - wall) >= search_dist: m = 0.0
+        px = 2.0 * wall - px
+        vx = -vx
+    elif dim == 1:
+        wall = mirror_wall[k]
+        if abs(py - wall) >= search_dist: m = 0.0
+        py = 2.0 * wall - py
+        vy = -vy
+
+    slot_x[k] = px
+    slot_y[k] = py
+    slot_vx[k] = vx
+    slot_vy[k] = vy
+    slot_mass[k] = m
+
+@cuda.jit
+def _density_kernel(pos_x, pos_y, masses, rho_refs, p0, inv_h2, sigma, cutoff2,
+                    nbr_offsets, nbr_indices, particle_ids, rho, pressures, densities):
+    """Pass 1 of physics.compute_density_and_forces: density and pressure per slot."""
+    i = cuda.grid(1)
+    if i >= pos_x.shape[0]:
+        return
+    d_i = np.float64(masses[i]) * cubic_spline_kernel(0.0, inv_h2, sigma)
+    for k in range(nbr_offsets[i], nbr_offsets[i + 1]):
+        j = nbr_indices[k]
+        dx_v = np.float64(pos_x[i]) - np.float64(pos_x[j])
+        dy_v = np.float64(pos_y[i]) - np.float64(pos_y[j])
+        r2 = dx_v * dx_v + dy_v * dy_v
+        if r2 < cutoff2:
+            d_i += np.float64(masses[j]) * cubic_spline_kernel(r2, inv_h2, sigma)
+
+    rho[i] = d_i
+    pressures[i] = p0 * ((d_i / rho_refs[i])**EOS_GAMMA - 1)
+    if particle_ids[i] >= 0:
+        densities[particle_ids[i]] = d_i
+
+@cuda.jit
+def _force_kernel(pos_x, pos_y, vel_x, vel_y, masses, rho, pressures, h, inv_h2, sigma, cutoff2,
+                  gravity_x, gravity_y, alpha, beta, nbr_offsets, nbr_indices, particle_ids,
+                  accelerations, viscosity_power):
+    """
+    Pass 2 of physics.compute_density_and_forces for real slots. Each thread sums
+    all of its own pair terms (no Newton's-third-law scatter), so no atomics are needed.
+    """
+    i = cuda.grid(1)
+    if i >= pos_x.shape[0]:
+        return
+    pid = particle_ids[i]
+    if pid < 0:
+        return
+
+    acc_x = 0.0
+    acc_y = 0.0
+    acc_visc_x = 0.0
+    acc_visc_y = 0.0
+    # Vacuum/invalid particles take no part in the forces (the comparison is also False for NaN)
+    if rho[i] >= MIN_DENSITY:
+        for k in range(nbr_offsets[i], nbr_offsets[i + 1]):
+            j = nbr_indices[k]
+            if not rho[j] >= MIN_DENSITY: continue
+
+            dx_vec = np.float64(pos_x[i]) - np.float64(pos_x[j])
+            dy_vec = np.float64(pos_y[i]) - np.float64(pos_y[j])
+            r2 = dx_vec * dx_vec + dy_vec * dy_vec
+            if r2 >= cutoff2 or r2 <= MIN_DIST_SQ: continue
+            gx, gy = cubic_spline_kernel_grad(dx_vec, dy_vec, r2, inv_h2, sigma)
+
+            fpx, fpy = calculate_pressure_force(pressures[i], pressures[j], rho[i], rho[j], gx, gy)
+            fvx, fvy = calculate_viscosity_force(
+                dx_vec, dy_vec, np.float64(vel_x[i]) - np.float64(vel_x[j]),
+                np.float64(vel_y[i]) - np.float64(vel_y[j]),
+                r2, rho[i], rho[j], h, alpha, beta, gx, gy
+            )
+
+            m_j = np.float64(masses[j])
+            acc_x += m_j * (fpx + fvx)
+            acc_y += m_j * (fpy + fvy)
+            acc_visc_x += m_j * fvx
+            acc_visc_y += m_j * fvy
+
+    accelerations[0, pid] = gravity_x + acc_x
+    accelerations[1, pid] = gravity_y + acc_y
+    viscosity_power[pid] = -np.float64(masses[i]) * (acc_visc_x * vel_x[i] + acc_visc_y * vel_y[i])
+
+def cuda_available():
+    """True if a CUDA device (or the Numba CUDA simulator) can be used."""
+    return cuda.is_available()
+
+class CudaPhysics:
+    """
+    Device-resident SPH force evaluation for SPHSolver.
+
+    Masses are uploaded once; the neighbor list, with the reference density of
+    every slot, is uploaded whenever a new one is passed in. Per call only the real positions and
+    velocities go to the device, and only the real densities, accelerations and
+    viscous power come back.
+    """
+    def __init__(self, masses, rho_refs, h, p0, gravity, alpha, beta=0.0):
+        self.h = h
+        self.p0 = p0
+        self.gravity = (float(gravity[0]), float(gravity[1]))
+        self.alpha = alpha
+        self.beta = beta
+        self.n = masses.shape[0]
+
+        self.inv_h2 = 1.0 / (h * h)
+        self.sigma = KERNEL_PREFACTOR_2D * self.inv_h2
+        self.cutoff2 = KERNEL_CUTOFF_SQ_FACTOR * h * h
+
+        self.rho_refs = rho_refs
+        self.d_masses = cuda.to_device(np.ascontiguousarray(masses, dtype=np.float64))
+        self.d_densities = cuda.device_array(self.n, dtype=np.float32)
+        self.d_accelerations = cuda.device_array((2, self.n), dtype=np.float32)
+        self.d_viscosity_power = cuda.device_array(self.n, dtype=np.float64)
+        self._list_neighbors = None
+
+    def _upload_neighbor_list(self, nl):
+        """Copies the slot layout and pair list of `nl` and sizes the slot buffers."""
+        n_slots = nl.source.shape[0]
+        self.d_source = cuda.to_device(nl.source)
+        self.d_mirror_dim = cuda.to_device(nl.mirror_dim)
+        self.d_mirror_wall = cuda.to_device(nl.mirror_wall)
+        self.d_particle_ids = cuda.to_device(nl.particle_ids)
+        self.d_offsets = cuda.to_device(nl.offsets)
+        self.d_neighbors = cuda.to_device(nl.neighbors)
+        self.d_slot_ref = cuda.to_device(self.rho_refs[nl.source].astype(SLOT_DTYPE))
+        self.d_slots = [cuda.device_array(n_slots, dtype=SLOT_DTYPE) for _ in range(5)]
+        self.d_rho = cuda.device_array(n_slots, dtype=np.float64)
+        self.d_pressures = cuda.device_array(n_slots, dtype=np.float64)
+        self._list_neighbors = nl.neighbors
+
+    def compute(self, pos_x, pos_y, vel_x, vel_y, nl):
+        """
+        Returns (densities, accelerations, viscosity_power) for the real particles:
+        host arrays in original particle order (accelerations as (2, n) rows) and
+        the total viscous power, summed on the device.
+        """
+        # A rebuild replaces the list's arrays, so identity tells whether to re-upload
+        if self._list_neighbors is not nl.neighbors:
+            self._upload_neighbor_list(nl)
+        n_slots = nl.source.shape[0]
+        blocks = math.ceil(n_slots / THREADS_PER_BLOCK)
+
+        d_pos_x, d_pos_y = cuda.to_device(pos_x), cuda.to_device(pos_y)
+        d_vel_x, d_vel_y = cuda.to_device(vel_x), cuda.to_device(vel_y)
+        slot_x, slot_y, slot_vx, slot_vy, slot_mass = self.d_slots
+
+        _gather_kernel[blocks, THREADS_PER_BLOCK](
+            d_pos_x, d_pos_y, d_vel_x, d_vel_y, self.d_masses,
+            self.d_source, self.d_mirror_dim, self.d_mirror_wall, 2.0 * self.h,
+            slot_x, slot_y, slot_vx, slot_vy, slot_mass
+        )
+        _density_kernel[blocks, THREADS_PER_BLOCK](
+            slot_x, slot_y, slot_mass, self.d_slot_ref, self.p0, self.inv_h2, self.sigma, self.cutoff2,
+            self.d_offsets, self.d_neighbors, self.d_particle_ids,
+            self.d_rho, self.d_pressures, self.d_densities
+        )
+        _force_kernel[blocks, THREADS_PER_BLOCK](
+            slot_x, slot_y, slot_vx, slot_vy, slot_mass, self.d_rho, self.d_pressures,
+            self.h, self.inv_h2, self.sigma, self.cutoff2, self.gravity[0], self.gravity[1],
+            self.alpha, self.beta, self.d_offsets, self.d_neighbors, self.d_particle_ids,
+            self.d_accelerations, self.d_viscosity_power
+        )
+
+        return (self.d_densities.copy_to_host(), self.d_accelerations.copy_to_host(),
+                _sum_reduce(self.d_viscosity_power))
@@ -2,65 +2,115 @@ import matplotlib.pyplot as plt
 import numpy as np
 from viz_utils import render_fluid_grid
 
-def save_simulation_frame(step, solver, viz_mode, viz_nx=400, viz_ny=200, output_dir='output'):
+# Figures are built once per plot type and reused for every frame: each call only
+# swaps the artists' data instead of rebuilding the figure. The simulation frame has
+# fixed, axis-free extents and is laid out once; the analysis figures keep their
+# per-call layout pass since their tick labels change with the data.
+_frame_figs = {}
+_analysis_figs = None
+
+def _get_frame_figure(viz_mode, viz_nx, viz_ny, title_text):
+    """Returns (fig, artists, title) for the simulation frame, creating it on first use."""
+    key = (viz_mode, viz_nx, viz_ny)
+    if key not in _frame_figs:
+        fig = plt.figure(figsize=(12, 6), facecolor='black')
+        ax = fig.gca()
+        ax.set_facecolor('black')
+
+        if viz_mode == 'smooth':
+            im = ax.imshow(np.zeros((viz_ny, viz_nx), dtype=np.float32), origin='lower', extent=[0, 0.1, 0, 0.05],
+                           cmap='cool', vmin=0, vmax=1, interpolation='bicubic')
+            artists = (im,)
+        else:
+            empty = np.empty((0, 2))
+            light = ax.scatter(empty[:, 0], empty[:, 1], c='#00FFFF', s=0.3, edgecolors='none', label='Light', rasterized=True)
+            heavy = ax.scatter(empty[:, 0], empty[:, 1], c='#FF00FF', s=0.3, edgecolors='none', label='Heavy', rasterized=True)
+            ax.set_xlim(0, 0.1); ax.set_ylim(0, 0.05); ax.set_aspect('equal')
+            artists = (light, heavy)
+
+        title = ax.set_title(title_text, color='white')
+        ax.axis('off')
+        fig.tight_layout()
+        _frame_figs[key] = (fig, artists, title)
+    return _frame_figs[key]
+
+def save_simulation_frame(step, pos, col, h, viz_mode, viz_nx=400, viz_ny=200, output_dir='output'):
     """Generates and saves the main simulation visualization."""
-    pos, _, _, _, col, _, _ = solver.get_state()
-    h = solver.h
-    
-    plt.figure(figsize=(12, 6), facecolor='black')
-    ax = plt.gca()
-    ax.set_facecolor('black')
-    
+    label = 'Smooth' if viz_mode == 'smooth' else 'Particles'
+    title_text = f"Neon RTI {label} Step {step}"
+    fig, artists, title = _get_frame_figure(viz_mode, viz_nx, viz_ny, title_text)
+
     if viz_mode == 'smooth':
         grid_img = render_fluid_grid(pos, col, h, viz_nx, viz_ny, 0.1, 0.05)
-        plt.imshow(grid_img, origin='lower', extent=[0, 0.1, 0, 0.05], 
-                   cmap='cool', vmin=0, vmax=1, interpolation='bicubic')
-        plt.title(f"Neon RTI Smooth Step {step}", color='white')
+        artists[0].set_data(grid_img)
     else:
-        plt.scatter(pos[col==0, 0], pos[col==0, 1], c='#00FFFF', s=0.3, edgecolors='none', label='Light')
-        plt.scatter(pos[col==1, 0], pos[col==1, 1], c='#FF00FF', s=0.3, edgecolors='none', label='Heavy')
-        plt.xlim(0, 0.1); plt.ylim(0, 0.05); plt.gca().set_aspect('equal')
-        plt.title(f"Neon RTI Particles Step {step}", color='white')
-    
-    plt.axis('off')
-    plt.tight_layout()
-    plt.savefig(f"{output_dir}/step_{step:05d}.png", facecolor='black', edgecolor='none')
-    plt.close()
+        artists[0].set_offsets(pos[col==0])
+        artists[1].set_offsets(pos[col==1])
+    title.set_text(title_text)
+
+    fig.savefig(f"{output_dir}/step_{step:05d}.png", facecolor='black', edgecolor='none')
+
+def _get_analysis_figures(history):
+    """Returns the velocity, energy and mixing figures with their artists, creating them on first use."""
+    global _analysis_figs
+    if _analysis_figs is None:
+        # Velocity Map
+        vel_fig = plt.figure(figsize=(10, 5), facecolor='black')
+        ax = vel_fig.gca(); ax.set_facecolor('black')
+        scatter = ax.scatter(np.empty(0), np.empty(0), c=np.empty(0), cmap='inferno', s=0.5, alpha=0.8, rasterized=True)
+        vel_fig.colorbar(scatter, ax=ax, label='Velocity').ax.tick_params(colors='white')
+        vel_title = ax.set_title("", color='white')
+        ax.set_xlim(0, 0.1); ax.set_ylim(0, 0.05); ax.axis('off')
+
+        # Energy Plot
+        energy_fig = plt.figure(figsize=(8, 4), facecolor='black')
+        ax = energy_fig.gca(); ax.set_facecolor('black')
+        energy_lines = {'Ek': ax.plot([], [], 'cyan', label='Ek')[0],
+                        'Ep': ax.plot([], [], 'magenta', label='Ep')[0]}
+        if 'Eint' in history:
+            energy_lines['Eint'] = ax.plot([], [], 'orange', label='Eint (Heat)')[0]
+        energy_lines['Etot'] = ax.plot([], [], 'white', linestyle='--', label='Etot')[0]
+        ax.legend(); energy_title = ax.set_title("", color='white')
+        ax.tick_params(colors='white')
+
+        # Mixing Plot
+        mixing_fig = plt.figure(figsize=(8, 4), facecolor='black')
+        ax = mixing_fig.gca(); ax.set_facecolor('black')
+        mixing_line = ax.plot([], [], 'lime', label='Width')[0]
+        ax.legend(); mixing_title = ax.set_title("", color='white')
+        ax.tick_params(colors='white')
+
+        _analysis_figs = ((vel_fig, scatter, vel_title),
+                          (energy_fig, energy_lines, energy_title),
+                          (mixing_fig, mixing_line, mixing_title))
+    return _analysis_figs
+
+def save_analysis_plots(step, t, pos, vel_mag, history, output_dir='output'):
+    """Generates and saves analysis plots (Velocity, Energy, Mixing); vel_mag is |v| per particle."""
+    (vel_fig, scatter, vel_title), (energy_fig, energy_lines, energy_title), \
+        (mixing_fig, mixing_line, mixing_title) = _get_analysis_figures(history)
 
-def save_analysis_plots(step, t, pos, vel, history, output_dir='output'):
-    """Generates and saves analysis plots (Velocity, Energy, Mixing)."""
     # Velocity Map
-    plt.figure(figsize=(10, 5), facecolor='black')
-    ax = plt.gca(); ax.set_facecolor('black')
-    vel_mag = np.linalg.norm(vel, axis=1)
-    scatter = plt.scatter(pos[:, 0], pos[:, 1], c=vel_mag, cmap='inferno', s=0.5, alpha=0.8)
-    plt.colorbar(scatter, label='Velocity').ax.tick_params(colors='white')
-    plt.title(f"Velocity Map Step {step}", color='white')
-    plt.xlim(0, 0.1); plt.ylim(0, 0.05); plt.axis('off')
-    plt.tight_layout()
-    plt.savefig(f"{output_dir}/vel_step_{step:05d}.png", facecolor='black', edgecolor='none')
-    plt.close()
+    scatter.set_offsets(pos)
+    scatter.set_array(vel_mag)
+    scatter.set_clim(vel_mag.min(), vel_mag.max())
+    vel_title.set_text(f"Velocity Map Step {step}")
+    vel_fig.tight_layout()
+    vel_fig.savefig(f"{output_dir}/vel_step_{step:05d}.png", facecolor='black', edgecolor='none')
 
     # Energy Plot
-    plt.figure(figsize=(8, 4), facecolor='black')
-    ax = plt.gca(); ax.set_facecolor('black')
-    plt.plot(history['time'], history['Ek'], 'cyan', label='Ek')
-    plt.plot(history['time'], history['Ep'], 'magenta', label='Ep')
-    if 'Eint' in history:
-        plt.plot(history['time'], history['Eint'], 'orange', label='Eint (Heat)')
-    plt.plot(history['time'], history['Etot'], 'white', linestyle='--', label='Etot')
-    plt.legend(); plt.title(f"Energy History (t={t:.3f}s)", color='white')
-    ax.tick_params(colors='white')
-    plt.tight_layout()
-    plt.savefig(f"{output_dir}/energy_latest.png", facecolor='black', edgecolor='none')
-    plt.close()
+    for key, line in energy_lines.items():
+        line.set_data(history['time'], history[key])
+    energy_ax = energy_title.axes
+    energy_ax.relim(); energy_ax.autoscale_view()
+    energy_title.set_text(f"Energy History (t={t:.3f}s)")
+    energy_fig.tight_layout()
+    energy_fig.savefig(f"{output_dir}/energy_latest.png", facecolor='black', edgecolor='none')
 
     # Mixing Plot
-    plt.figure(figsize=(8, 4), facecolor='black')
-    ax = plt.gca(); ax.set_facecolor('black')
-    plt.plot(history['time'], history['mixing_width'], 'lime', label='Width')
-    plt.legend(); plt.title(f"Mixing Width (t={t:.3f}s)", color='white')
-    ax.tick_params(colors='white')
-    plt.tight_layout()
-    plt.savefig(f"{output_dir}/mixing_latest.png", facecolor='black', edgecolor='none')
-    plt.close()
+    mixing_line.set_data(history['time'], history['mixing_width'])
+    mixing_ax = mixing_title.axes
+    mixing_ax.relim(); mixing_ax.autoscale_view()
+    mixing_title.set_text(f"Mixing Width (t={t:.3f}s)")
+    mixing_fig.tight_layout()
+    mixing_fig.savefig(f"{output_dir}/mixing_latest.png", facecolor='black', edgecolor='none')
@@ -1,10 +1,13 @@
 import numpy as np
 import argparse
+import atexit
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 from io_utils import save_checkpoint, load_latest_checkpoint, rebuild_history, setup_directories, load_or_init_state
 from plot_utils import save_simulation_frame, save_analysis_plots
 from rti_setup import get_domain_size
+from stats_utils import partition_percentile
 from sph_solver import SPHSolver
 
 # --- Simulation Constants ---
@@ -17,27 +20,37 @@ ALPHA = 0.01               # Artificial viscosity coefficient (Reduced from 0.05
 CHECKPOINT_INTERVAL = 300  # Steps between checkpoints
 VIZ_INTERVAL = 500         # Steps between visualization frames
 
+# Checkpoints are written by one background thread so the step loop never waits on disk;
+# interpreter exit waits for the last write.
+_ckpt_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='checkpoint')
+_pending_checkpoint = None
+atexit.register(_ckpt_pool.shutdown, wait=True)
+
 # --- Visualization & Analysis ---
 
-def perform_visualization(step, solver, viz_mode, viz_nx=400, viz_ny=200):
+def perform_visualization(step, state, h, viz_mode, viz_nx=400, viz_ny=200):
     """Generates and saves the main simulation visualization."""
-    save_simulation_frame(step, solver, viz_mode, viz_nx, viz_ny)
+    pos, _, _, _, col, _, _ = state
+    save_simulation_frame(step, pos, col, h, viz_mode, viz_nx, viz_ny)
 
-def perform_analysis(step, t, solver, history):
+def perform_analysis(step, t, state, history):
     """Calculates analysis metrics and updates live plots."""
-    pos, vel, mass, dens, col, _, internal_energy = solver.get_state()
+    pos, vel, mass, dens, col, _, internal_energy = state
     
     # 1. Calculate Metrics
-    v_sq = np.sum(vel**2, axis=1)
-    Ek = 0.5 * np.sum(mass * v_sq)
-    Ep = np.sum(mass * 100.0 * pos[:, 1])
+    # |v|^2 per particle without a squared temporary; energies accumulate in float64
+    v_sq = np.einsum('ij,ij->i', vel, vel, dtype=np.float64)
+    vel_mag = np.sqrt(v_sq)
+    Ek = 0.5 * np.dot(mass.astype(np.float64), v_sq)
+    Ep = 100.0 * np.sum(mass * pos[:, 1], dtype=np.float64)
     Etot = Ek + Ep + internal_energy
     
-    pos_light = pos[col == 0]
-    pos_heavy = pos[col == 1]
-    if len(pos_light) > 0 and len(pos_heavy) > 0:
-        h_bubble = np.percentile(pos_light[:, 1], 99)
-        h_spike = np.percentile(pos_heavy[:, 1], 1)
+    y = pos[:, 1]
+    y_light = y[col == 0]
+    y_heavy = y[col == 1]
+    if len(y_light) > 0 and len(y_heavy) > 0:
+        h_bubble = partition_percentile(y_light, 99)
+        h_spike = partition_percentile(y_heavy, 1)
         width = h_bubble - h_spike
     else:
         width = 0.0
@@ -53,14 +66,37 @@ def perform_analysis(step, t, solver, history):
         history['mixing_width'].append(width)
         
     # 3. Live Plots
-    save_analysis_plots(step, t, pos, vel, history)
+    save_analysis_plots(step, t, pos, vel_mag, history)
     
     print(f"  Rho Avg: {np.mean(dens):.1f} (Min: {np.min(dens):.1f}, Max: {np.max(dens):.1f})", flush=True)
-    print(f"  Max Vel: {np.max(np.linalg.norm(vel, axis=1)):.2f}", flush=True)
+    print(f"  Max Vel: {np.max(vel_mag):.2f}", flush=True)
     print(f"  Energy: Mech={Ek+Ep:.4e}, Int={internal_energy:.4e}, Tot={Etot:.4e}", flush=True)
 
 # --- Simulation Orchestration ---
 
+def save_checkpoint_async(step, solver):
+    """
+    Snapshots the solver state and hands it to the background writer.
+    Waits for the previous write first, so at most one snapshot is in flight
+    and a failed write raises here instead of being lost.
+    """
+    global _pending_checkpoint
+    wait_for_checkpoint()
+    
+    pos, vel, mass, dens, col, ref, internal_energy = solver.get_state()
+    # Positions, velocities and densities change every step; masses, colors and rho_refs are constant
+    _pending_checkpoint = _ckpt_pool.submit(
+        save_checkpoint, step, pos.copy(), vel.copy(), mass, dens.copy(), col, ref,
+        internal_energy=internal_energy
+    )
+
+def wait_for_checkpoint():
+    """Waits for the checkpoint in flight, if any; a failed write raises here."""
+    global _pending_checkpoint
+    if _pending_checkpoint is not None:
+        pending, _pending_checkpoint = _pending_checkpoint, None
+        pending.result()
+
 def print_simulation_config():
     """Prints the current simulation configuration."""
     print("="*40)
@@ -76,7 +112,7 @@ def print_simulation_config():
     print(f"Visualization Interval: {VIZ_INTERVAL}")
     print("="*40)
 
-def run_simulation(viz_mode='smooth', clear=False):
+def run_simulation(viz_mode='smooth', clear=False, use_cuda=False):
     """
     Main entry point for the simulation.
     Orchestrates setup, solver initialization, and the main loop.
@@ -93,7 +129,7 @@ def run_simulation(viz_mode='smooth', clear=False):
     
     # 3. Solver
     solver = SPHSolver(pos, vel, mass, dens, col, refs,
-                       H, DT, P0, GRAVITY, domain_min, domain_max, alpha=ALPHA)
+                       H, DT, P0, GRAVITY, domain_min, domain_max, alpha=ALPHA, use_cuda=use_cuda)
     solver.internal_energy = internal_energy # Set initial internal energy
     print(f"Total particles: {solver.n}")
     
@@ -104,25 +140,30 @@ def run_simulation(viz_mode='smooth', clear=False):
 
 def _run_simulation_loop(solver, start_step, max_steps, dt, viz_mode, history):
     """Execution loop handling physics stepping, IO, and analysis."""
-    for step in range(start_step, max_steps):
-        solver.step_physics()
-        
-        # Checkpointing
-        if step % CHECKPOINT_INTERVAL == 0:
-            pos, vel, mass, dens, col, ref, internal_energy = solver.get_state()
-            save_checkpoint(step, pos, vel, mass, dens, col, ref, internal_energy=internal_energy)
+    try:
+        for step in range(start_step, max_steps):
+            solver.step_physics()
             
-        # Visualization & Analysis
-        if step % VIZ_INTERVAL == 0:
-            current_t = step * dt
-            print(f"Step {step} (t={current_t:.4f}s)", flush=True)
-            perform_visualization(step, solver, viz_mode)
-            perform_analysis(step, current_t, solver, history)
+            # Checkpointing
+            if step % CHECKPOINT_INTERVAL == 0:
+                save_checkpoint_async(step, solver)
+                
+            # Visualization & Analysis
+            if step % VIZ_INTERVAL == 0:
+                current_t = step * dt
+                print(f"Step {step} (t={current_t:.4f}s)", flush=True)
+                state = solver.get_state()
+                perform_visualization(step, state, solver.h, viz_mode)
+                perform_analysis(step, current_t, state, history)
+    finally:
+        # The last checkpoint is the one a resume starts from: surface a failed write
+        wait_for_checkpoint()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='SPH Rayleigh-Taylor Simulation')
     parser.add_argument('--clear', action='store_true', help='Clear existing checkpoints and start fresh')
     parser.add_argument('--viz-mode', choices=['smooth', 'particles'], default='smooth', help='Visualization style')
+    parser.add_argument('--cuda', action='store_true', help='Compute densities and forces on a CUDA GPU')
     args = parser.parse_args()
     
-    run_simulation(viz_mode=args.viz_mode, clear=args.clear)
+    run_simulation(viz_mode=args.viz_mode, clear=args.clear, use_cuda=args.cuda)
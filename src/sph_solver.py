@@ -1,15 +1,32 @@
 import numpy as np
-from physics import compute_density, compute_pressure, compute_forces
-from boundaries import generate_ghost_particles
-from neighbor_search import build_grid
+from numba import get_num_threads
+from physics import compute_density_and_forces
+from boundaries import SLOT_DTYPE, gather_ghosted_state
+from neighbor_search import NeighborList
+from integrator import kick_drift_reflect, closing_kick
+
+# Verlet skin as a fraction of h: the neighbor list covers 2h + skin and is rebuilt
+# once some particle has moved skin / 2 (~10 steps at the velocities of this problem).
+NEIGHBOR_SKIN_FACTOR = 0.2
+
+# Storage type of the per-particle velocities, masses, densities and accelerations
+STATE_DTYPE = np.float32
+
+# Ghost capacity of the slot buffers, as a multiple of the ghost count that (re)sizes them
+GHOST_CAPACITY_GROWTH = 1.5
 
 class SPHSolver:
     def __init__(self, positions, velocities, masses, densities, colors, rho_refs, 
-                 h, dt, p0, gravity, domain_min, domain_max, alpha=0.02):
-        self.positions = positions
-        self.velocities = velocities.astype(np.float64)
-        self.masses = masses.astype(np.float64)
-        self.densities = densities.astype(np.float64)
+                 h, dt, p0, gravity, domain_min, domain_max, alpha=0.02, use_cuda=False):
+        # Particle state is float32 (STATE_DTYPE), except positions: a drift of v*dt = 4e-9 m
+        # (v = 1 mm/s) is below the float32 spacing at x = 0.05 m and would be lost.
+        # Sums (density, forces, energies) are still accumulated in float64.
+        # Vectors are stored per axis (SoA): pos, vel and acc are (2, n) with rows x and y,
+        # so every kernel streams unit-stride 1-D arrays.
+        self.pos = np.ascontiguousarray(positions.T, dtype=np.float64)
+        self.vel = np.ascontiguousarray(velocities.T, dtype=STATE_DTYPE)
+        self.masses = masses.astype(STATE_DTYPE)
+        self.densities = densities.astype(STATE_DTYPE)
         self.internal_energy = 0.0 # Total dissipated energy
         
         # Fluid properties
@@ -20,13 +37,34 @@ class SPHSolver:
         self.dt = dt
         self.p0 = p0
         self.gravity = gravity
-        self.domain_min = domain_min
-        self.domain_max = domain_max
+        self.domain_min = np.ascontiguousarray(domain_min, dtype=np.float64)
+        self.domain_max = np.ascontiguousarray(domain_max, dtype=np.float64)
         self.alpha = alpha
         
         self.grid_size = 2 * h
         self.n = len(positions)
         
+        # Neighbor list (with ghost layout), reused across steps
+        self.neighbor_list = NeighborList(h, self.domain_min, self.domain_max, NEIGHBOR_SKIN_FACTOR * h)
+        
+        # Per-slot state buffers (real + ghost), kept across steps. Sized with headroom
+        # by the first neighbor list build below and only regrown if the ghost band outgrows it.
+        # The reference densities per slot are static: refilled only when the layout changes.
+        self._ghost_cap = 0
+        self._slot_buffer = np.empty((5, self.n), dtype=SLOT_DTYPE)
+        self._slot_ref = np.empty(self.n, dtype=SLOT_DTYPE)
+        # Per-chunk force and power accumulators of the force pass, sized with the slot buffers
+        self._chunk_acc = np.empty((0, 0, 2))
+        self._chunk_power = np.empty(0)
+        
+        # Optional GPU backend for the ghost gather and force passes (imported only when asked for)
+        self.cuda_physics = None
+        if use_cuda:
+            from physics_cuda import CudaPhysics, cuda_available
+            if not cuda_available():
+                raise RuntimeError("use_cuda=True but no CUDA device is available")
+            self.cuda_physics = CudaPhysics(self.masses, self.rho_refs, h, p0, gravity, alpha)
+        
         # Initial Force Calc
         self.step_physics(first_step=True)
 
@@ -37,74 +75,94 @@ class SPHSolver:
         Otherwise, performs Kick-Drift-Kick integration.
         """
         
+        pos_x, pos_y = self.pos
+        vel_x, vel_y = self.vel
+        
         if first_step:
             # Just compute initial accelerations
-            self.accelerations, _ = self._compute_accel(self.positions, self.velocities)
+            self.acc, _ = self._compute_accel(pos_x, pos_y, vel_x, vel_y)
             return
 
-        # --- KICK (Half Step Velocity) ---
-        v_half = self.velocities + self.accelerations * (self.dt / 2.0)
-        
-        # --- DRIFT (Full Step Position) ---
-        self.positions += v_half * self.dt
-        
-        # --- BOUNDARY CONDITIONS ---
-        for dim, (dmin, dmax) in enumerate(zip(self.domain_min, self.domain_max)):
-            mask_lo = self.positions[:, dim] < dmin
-            mask_hi = self.positions[:, dim] > dmax
-            self.positions[mask_lo, dim] = dmin + (dmin - self.positions[mask_lo, dim])
-            self.positions[mask_hi, dim] = dmax - (self.positions[mask_hi, dim] - dmax)
-            v_half[mask_lo | mask_hi, dim] *= -0.5
+        # --- KICK (Half Step Velocity) + DRIFT (Full Step Position) + BOUNDARY CONDITIONS ---
+        # One in-place pass: self.vel holds v(t+dt/2) until the closing kick
+        kick_drift_reflect(pos_x, pos_y, vel_x, vel_y, self.acc[0], self.acc[1], self.dt,
+                           self.domain_min, self.domain_max)
             
         # --- COMPUTE FORCES        # 2. Compute accelerations and force
-        new_accelerations, visc_power = self._compute_accel(self.positions, v_half)
+        new_acc, visc_power = self._compute_accel(pos_x, pos_y, vel_x, vel_y)
         
         # Update internal energy (Dissipated by viscosity)
         # Power is Watts (J/s), so Energy = Power * dt
-        self.internal_energy += np.sum(visc_power) * self.dt
+        self.internal_energy += visc_power * self.dt
         
         # 3. Full step velocity
-        self.velocities = v_half + 0.5 * new_accelerations * self.dt
-        self.accelerations = new_accelerations
+        closing_kick(vel_x, vel_y, new_acc[0], new_acc[1], self.dt)
+        self.acc = new_acc
 
-    def _compute_accel(self, pos, vel):
+    def _compute_accel(self, pos_x, pos_y, vel_x, vel_y):
         """
         Internal wrapper for physics kernels.
-        Handles Ghost Particles -> Grid Build -> Density -> Pressure -> Forces.
+        Handles Neighbor List -> Ghost Particles -> Density/Pressure/Forces (fused).
         """
-        # 1. Ghost Particles
-        all_pos, all_vel, all_mass, all_dens, all_col, all_ref = generate_ghost_particles(
-            pos, vel, self.masses, self.densities, self.colors, self.rho_refs, 
-            self.h, self.domain_min, self.domain_max
-        )
+        # 1. Neighbor list, rebuilt only once the skin may have been crossed
+        nl = self.neighbor_list
+        rebuilt = nl.needs_rebuild(pos_x, pos_y)
+        if rebuilt:
+            nl.build(pos_x, pos_y)
+        
+        if self.cuda_physics is not None:
+            # 2-3. Ghost gather, density, pressure and forces on the GPU
+            self.densities, accels, visc_power = self.cuda_physics.compute(pos_x, pos_y, vel_x, vel_y, nl)
+            return accels, visc_power
         
-        # 2. Build Grid
-        nx_cells, ny_cells, cell_offsets, sorted_indices = build_grid(
-            all_pos, self.domain_min, self.domain_max, self.grid_size
+        # 2. Ghost Particles: real and mirrored state gathered into the list's slot order (SoA)
+        n_slots = len(nl.source)
+        n_ghost = n_slots - self.n
+        if n_ghost > self._ghost_cap:
+            self._ghost_cap = int(GHOST_CAPACITY_GROWTH * n_ghost)
+            self._slot_buffer = np.empty((5, self.n + self._ghost_cap), dtype=SLOT_DTYPE)
+            self._slot_ref = np.empty(self.n + self._ghost_cap, dtype=SLOT_DTYPE)
+        slot_ref = self._slot_ref[:n_slots]
+        if rebuilt: # (the only time the ghost count, and so the buffers, can change)
+            slot_ref[:] = self.rho_refs[nl.source]
+        slot_x, slot_y, slot_vx, slot_vy, slot_mass = gather_ghosted_state(
+            pos_x, pos_y, vel_x, vel_y, self.masses,
+            nl.source, nl.mirror_dim, nl.mirror_wall, 2 * self.h, self._slot_buffer
         )
         
-        # 3. Density
-        densities_all = compute_density(
-            all_pos, all_mass, self.h, self.domain_min, self.grid_size, 
-            nx_cells, ny_cells, cell_offsets, sorted_indices
+        n_chunks = get_num_threads()
+        slot_cap = self._slot_buffer.shape[1]
+        if self._chunk_acc.shape[0] != n_chunks or self._chunk_acc.shape[1] != slot_cap:
+            self._chunk_acc = np.empty((n_chunks, slot_cap, 2))
+            self._chunk_power = np.empty(n_chunks)
+        
+        # 3. Density, Pressure and Forces
+        # Note: forces are only computed for the self.n real particles
+        densities, accels, visc_power = compute_density_and_forces(
+            slot_x, slot_y, slot_vx, slot_vy, slot_mass, slot_ref, self.p0,
+            self.h, self.gravity, nl.offsets, nl.neighbors, nl.particle_ids, self.n,
+            self._chunk_acc, self._chunk_power, alpha=self.alpha
         )
         
         # Update self.densities (real particles only)
-        self.densities = densities_all[:self.n]
-        
-        # 4. Pressure
-        pressures_all = compute_pressure(densities_all, all_ref, self.p0)
-        
-        # Compute Forces
-        # Note: we pass n_active to only iterate over real particles
-        accels_all, visc_power_all = compute_forces(
-            all_pos, all_vel, densities_all, pressures_all, all_mass,
-            self.h, self.gravity, self.domain_min, self.grid_size,
-            nx_cells, ny_cells, cell_offsets, sorted_indices, self.n,
-            alpha=self.alpha
-        )
+        self.densities = densities
         
-        return accels_all, visc_power_all
+        return accels, visc_power
+
+    @property
+    def positions(self):
+        """Positions as an (n, 2) view of the per-axis storage."""
+        return self.pos.T
+
+    @property
+    def velocities(self):
+        """Velocities as an (n, 2) view of the per-axis storage."""
+        return self.vel.T
+
+    @property
+    def accelerations(self):
+        """Accelerations as an (n, 2) view of the per-axis storage."""
+        return self.acc.T
 
     def get_state(self):
         """Returns the current state of real particles."""
@@ -0,0 +1,22 @@
+import numpy as np
+
+def partition_percentile(values, q):
+    """
+    Computes a single percentile of a 1D array using np.partition.
+    Selection is O(n), and only the two order statistics bracketing the
+    percentile are placed, so it is much cheaper than np.percentile for one quantile.
+    Uses the same linear interpolation as np.percentile's default method.
+    
+    Parameters:
+    values (np.array): 1D array of samples.
+    q (float): Percentile in [0, 100].
+    
+    Returns:
+    float: The q-th percentile of values.
+    """
+    n = values.shape[0]
+    pos = (q / 100.0) * (n - 1)
+    lo = int(pos)
+    hi = min(lo + 1, n - 1)
+    part = np.partition(values, (lo, hi))
+    return part[lo] + (part[hi] - part[lo]) * (pos - lo)